@@ -6,18 +6,37 @@
 Eurgh - an application message catalog translation utility using the
 Microsoft Translator API.
 """
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import copy
 import json
+import threading
+import time
 
 import sys
 import os
 from configparser import ConfigParser
-from logging import getLogger
+from logging import DEBUG, getLogger
 from logging.config import fileConfig
 import codecs
 
-from babel.messages.pofile import read_po, write_po
-from eurgh.translator import EurghTranslator
+from eurgh.budget import CharacterBudget
+from eurgh.catalogio import CatalogIO
+from eurgh.catalogview import PendingMessages
+from eurgh.daemon import serve
+from eurgh.discovery import CatalogDomain, discover
+from eurgh.files import atomic_write
+from eurgh.fuzzy import FuzzyIndex
+from eurgh.journal import Journal
+from eurgh.jsonstream import translate_json_file
+from eurgh.manifest import Manifest, json_message_hashes, pot_message_hashes
+from eurgh.metrics import MetricsReporter
+from eurgh.plan import CatalogJob, TranslationPlan
+from eurgh.placeholders import placeholders_match
+from eurgh.plurals import plural_sources
+from eurgh.textstream import DEFAULT_PIPELINE, translate_stream
+from eurgh.backend import get_backend
 
 
 __author__ = 'Preston Landers (planders@gmail.com)'
@@ -37,221 +56,577 @@ class EurghApp(object):
         global log
         self.config = config = ConfigParser()
         config.read(config_file)
-        fileConfig(config_file, disable_existing_loggers=False)
+        if config.has_section("loggers"):
+            fileConfig(config_file, disable_existing_loggers=False)
 
         self.from_lang = config.get("translate", "from_lang")
         self.to_langs = config.get("translate", "to_lang").split(" ")
         self.app_locale_dir = config.get("app", "locale_dir", fallback=None)
         self.app_domain = config.get("app", "domain", fallback="messages")
+        # Discovery mode: translate every domain (app.domains) in every locale
+        # directory matching app.locale_dirs in one run.
+        self.app_locale_dirs = config.get("app", "locale_dirs", fallback="").split()
+        self.app_domains = config.get("app", "domains", fallback="").split()
+        self.discovery = bool(self.app_locale_dirs or self.app_domains)
         self.app_encoding = config.get("app", "encoding", fallback="utf-8")
         self.blank_only = config.getboolean("app", "blank_only", fallback=True)
+        # Reuse the translations of similar strings in the catalogs loaded, flagged fuzzy.
+        self.fuzzy_index = FuzzyIndex.from_config(config)
+        if self.fuzzy_index is not None and not self.blank_only:
+            log.warn("Fuzzy reuse of translations needs app.blank_only; turning it off.")
+            self.fuzzy_index = None
 
         self.use_json = config.getboolean("app", "json", fallback=False)
-
-        self.translator = EurghTranslator(config_file)
-
-    def translate_app_source(self):
-        if not self.app_locale_dir:
+        # Stream JSON files instead of loading them into memory (supports nested objects).
+        self.json_streaming = config.getboolean("app", "json_streaming", fallback=False)
+
+        # Number of languages, and of request blocks per catalog, worked on at once.
+        self.workers = config.getint("app", "workers", fallback=1)
+        # Catalogs are parsed and written in this many processes (app.processes), if set.
+        self.catalog_io = CatalogIO.from_config(config)
+        self.io_workers = max(self.workers, self.catalog_io.processes)
+
+        self.manifest = Manifest.from_config(config, self.app_locale_dir)
+
+        # Checkpointing: results of each batch are journaled, and catalogs are
+        # written out every checkpoint_batches batches.
+        self.journal = Journal.from_config(config, self.app_locale_dir)
+        self.checkpoint_batches = config.getint("app", "checkpoint_batches", fallback=0)
+        self._flush_lock = threading.Lock()
+
+        # Limits on the characters sent, spent on the most important strings first.
+        self.budget = CharacterBudget.from_config(config)
+
+        self.translator = get_backend(config_file)
+        # Counters and timings for the run, shared with the backend.
+        self.metrics = self.translator.metrics
+        self.metrics_reporter = MetricsReporter.from_config(config, labels={"domain": self.app_domain})
+
+    def translate_app_source(self, dry_run=False, resume=False):
+        """
+        Translate every configured language's catalog (or JSON file).
+
+        All pending strings are gathered into one TranslationPlan first, so
+        that each unique string is requested only once per language.
+
+        :param dry_run: if True, make no API calls or changes and just return
+            the plan's report.
+        :param resume: if True, reuse the results journaled by an unfinished run.
+        :return: the plan's report (dict of statistics).
+        """
+        if resume and self.journal is None:
+            raise ValueError("You must set app.journal_file in the config file to resume a run.")
+        if not self.app_locale_dir and not self.app_locale_dirs:
             raise ValueError("You must set app.locale_dir in the config file to use this feature.")
-        if not os.path.exists(self.app_locale_dir):
+        if self.app_locale_dir and not os.path.exists(self.app_locale_dir):
             raise ValueError("Can't find your app.locale_dir at %s" % (self.app_locale_dir,))
         if not self.from_lang:
             raise ValueError("No from_lang specified in config file.")
         if not self.to_langs:
             raise ValueError("No to_lang specified in config file.")
-        for lang in self.to_langs:
-            self.translate_app_language(lang)
+
+        start = time.time()
+        try:
+            plan = self.plan_app_source(resume)
+            report = plan.report(self.translator.max_batch_strings, self.translator.max_batch_chars)
+            log.info("Translation plan: %s", report)
+            for job, chars in plan.catalog_characters():
+                log.info("Estimated %s characters into %s for: %s", chars, job.to_lang, job.name)
+            if report["deferred_strings"]:
+                log.warn("Over the character budget: %s strings (%s characters) are left for a later run.",
+                         report["deferred_strings"], report["deferred_characters"])
+            if dry_run:
+                return report
+
+            status = "failed"
+            try:
+                self.execute_plan(plan, resume=resume)
+                status = "completed"
+            finally:
+                self.metrics.observe("run_seconds", time.time() - start)
+                self.write_metrics(report, status)
+        finally:
+            self.catalog_io.close()
         log.info("Finished.")
+        return report
+
+    def translate_text(self, infile, outfile, to_lang=None, paragraphs=False):
+        """
+        Translate plain text from infile to outfile, line by line (or
+        paragraph by paragraph), with several requests in flight at once.
+
+        :return: number of lines or paragraphs translated.
+        """
+        pipeline = getattr(self.translator, "max_in_flight", DEFAULT_PIPELINE)
+        return translate_stream(self.translator, infile, outfile, to_lang, paragraphs, pipeline)
+
+    def plan_app_source(self, resume=False):
+        """
+        :return: a TranslationPlan with the jobs of every configured language.
+        """
+        # Every catalog is parsed at once, in processes if configured.
+        items = [(lang, catalog_domain) for catalog_domain in self.catalog_domains() for lang in self.to_langs]
+        plan = TranslationPlan(self.translator.mask_placeholders, self.budget)
+        for job in self.run_tasks(lambda item: self.plan_app_language(*item), items, self.io_workers):
+            if job is not None:
+                plan.add_job(job)
+        if resume:
+            journaled = self.journal.replay(self.from_lang, self.translator.result_category)
+            for to_lang, results in journaled.items():
+                plan.add_results(to_lang, results)
+                self.metrics.incr("journal_hits", len(results))
+        self.fill_from_memory(plan)
+        if self.fuzzy_index is not None:
+            self.metrics.incr("fuzzy_matches", self.fuzzy_index.fill(plan))
+        return plan
+
+    def fill_from_memory(self, plan):
+        """
+        Give the plan's pending strings their translations from the
+        translation memory, if configured, so that they are neither
+        requested nor charged to the budget.
+
+        :return: number of strings filled in.
+        """
+        memory = self.translator.memory
+        if memory is None:
+            return 0
+        count = 0
+        for to_lang in plan.pending:
+            found = memory.lookup(self.from_lang, to_lang, self.translator.result_category, plan.unresolved(to_lang))
+            if found:
+                plan.add_results(to_lang, found)
+                count += len(found)
+        self.metrics.incr("memory_hits", count)
+        return count
+
+    def catalog_domains(self):
+        """
+        :return: list of the CatalogDomain to translate: just app.locale_dir
+            and app.domain, unless in discovery mode.
+        """
+        if not self.discovery:
+            return [CatalogDomain(self.app_locale_dir, self.app_domain)]
+        json_source_template = None
+        if self.use_json:
+            json_source_template = self.config.get("app", "json_source_file", fallback="", raw=True)
+        return discover(self.app_locale_dirs or [self.app_locale_dir], self.app_domains or [self.app_domain],
+                        json_source_template)
+
+    def pot_file(self, catalog_domain):
+        """
+        :return: path of the .pot template of the domain.
+        """
+        # The fallback isn't interpolated, so the default is made here.
+        pot_file = self.config.get("app", "pot_file", fallback=None, vars={"domain": catalog_domain.domain})
+        if not pot_file:
+            pot_file = "%s.pot" % (catalog_domain.domain,)
+        if catalog_domain.locale_dir:
+            pot_file = os.path.join(catalog_domain.locale_dir, pot_file)
+        return pot_file
+
+    def write_metrics(self, plan_report, status):
+        """
+        Write out the run report and Prometheus textfile, if configured.
+        """
+        extra = OrderedDict([("status", status), ("plan", plan_report)])
+        try:
+            self.metrics_reporter.write(self.metrics, extra)
+        except (IOError, OSError) as e:
+            log.error("Can't write metrics: %s", e)
+        return
+
+    def execute_plan(self, plan, resume=False):
+        """
+        Translate the plan's strings and finish its jobs. Each language's jobs
+        are finished (and their files written) in the background as soon as
+        the language is translated, while requests for the others continue.
+        If a request fails, the results so far are written out before the
+        error is raised.
+        """
+        if self.journal is not None:
+            self.journal.start(resume=resume)
+        finishing = []
+        finisher = ThreadPoolExecutor(max_workers=max(1, self.io_workers))
+
+        def language_done(_plan, to_lang):
+            finishing.append(finisher.submit(plan.finish_language, to_lang))
+
+        try:
+            try:
+                plan.execute(self.translator, self.run_tasks, self.journal, self.checkpoint, language_done)
+            finally:
+                finisher.shutdown(wait=True)
+            for future in finishing:
+                future.result()
+        except Exception:
+            log.error("Translation failed; writing out the results so far.")
+            with self._flush_lock:
+                plan.flush()
+            if self.journal is not None:
+                self.journal.close()
+            raise
+        plan.finish(lambda func, items: self.run_tasks(func, items, self.io_workers))
+        self.save_manifest()
+        if self.journal is not None:
+            self.journal.close(completed=True)
+        return
+
+    def checkpoint(self, plan, completed_batches):
+        if self.checkpoint_batches and completed_batches % self.checkpoint_batches == 0:
+            log.info("Checkpoint after %s batches: writing out results so far.", completed_batches)
+            with self._flush_lock:
+                plan.flush()
+        return
+
+    def run_tasks(self, func, items, workers=None):
+        """
+        Call func on each item, using up to workers (default self.workers)
+        threads at once.
+
+        :return: list of results in the same order as items.
+        """
+        if workers is None:
+            workers = self.workers
+        if workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+            return list(executor.map(func, items))
+
+    def run_job(self, job):
+        """
+        Translate and finish a single job with its own plan.
+        """
+        plan = TranslationPlan(self.translator.mask_placeholders, self.budget)
+        plan.add_job(job)
+        self.fill_from_memory(plan)
+        self.execute_plan(plan)
+        return
+
+    def save_manifest(self):
+        if self.manifest is not None:
+            self.manifest.save()
         return
 
-    def translate_app_language(self, lang):
+    def is_current(self, target_path, source_path, hash_messages):
+        """
+        :return: True if incremental mode is on and target_path doesn't need
+            to be looked at again.
+        """
+        if self.manifest is None:
+            return False
+        if self.manifest.is_current(target_path, source_path, hash_messages):
+            log.info("Skipping unchanged file: %s", target_path)
+            self.metrics.incr("catalogs_skipped")
+            return True
+        return False
+
+    def track_job(self, job, source_path, hash_messages):
+        """
+        Have the job record its target file in the manifest when finished,
+        unless the budget deferred some of its strings to a later run.
+        """
+        if self.manifest is None or job is None:
+            return job
+        job_finish = job.finish
+
+        def finish(plan):
+            job_finish(plan)
+            deferred = plan.deferred_count(job)
+            if deferred:
+                log.info("Not recording %s in the manifest: %s strings are left for a later run.",
+                         job.name, deferred)
+                return
+            self.manifest.record(job.name, source_path, hash_messages)
+
+        return job._replace(finish=finish)
+
+    def hash_pot_file(self, path):
+        return pot_message_hashes(path, self.app_encoding)
+
+    def hash_json_file(self, path):
+        return json_message_hashes(path, self.app_encoding)
+
+    def translate_app_language(self, lang, catalog_domain=None):
+        job = self.plan_app_language(lang, catalog_domain)
+        if job is not None:
+            self.run_job(job)
+        return
+
+    def plan_app_language(self, lang, catalog_domain=None):
+        """
+        :param catalog_domain: the CatalogDomain; default is app.locale_dir and app.domain.
+        :return: a CatalogJob for the language, or None if there's nothing to do.
+        """
         if self.use_json:
-            return self.translate_app_language_json(lang)
-        return self.translate_app_language_mc(lang)
+            return self.plan_app_language_json(lang, catalog_domain)
+        return self.plan_app_language_mc(lang, catalog_domain)
+
+    def translate_app_language_json(self, lang, catalog_domain=None):
+        job = self.plan_app_language_json(lang, catalog_domain)
+        if job is not None:
+            self.run_job(job)
+        return
 
-    def translate_app_language_json(self, lang):
-        domain = self.app_domain
+    def missing_file(self, msg):
+        """
+        A catalog or JSON file is missing: an error normally, but in discovery
+        mode not every domain needs to have every language.
+        """
+        if self.discovery:
+            log.info("Skipping: %s", msg.splitlines()[0])
+            return None
+        log.error(msg)
+        raise IOError(msg)
+
+    def plan_app_language_json(self, lang, catalog_domain=None):
+        if catalog_domain is None:
+            catalog_domain = CatalogDomain(self.app_locale_dir, self.app_domain)
+        locale_dir = catalog_domain.locale_dir
+        domain = catalog_domain.domain
         locale = lang
 
         targetFile = self.config.get(
-            "app", "json_file_template", fallback='', vars=locals())
+            "app", "json_file_template", fallback='', vars={"domain": domain, "locale": locale})
 
         sourceFile = self.config.get(
-            "app", "json_source_file", fallback='', vars=locals())
+            "app", "json_source_file", fallback='', vars={"domain": domain, "locale": locale})
 
         if not targetFile or not sourceFile:
             log.info('No source or target files. source: %s  target: %s' % (sourceFile, targetFile))
-            return
+            return None
 
-        lang_json_file = os.path.join(self.app_locale_dir, targetFile)
+        lang_json_file = os.path.join(locale_dir, targetFile)
         if not os.path.exists(lang_json_file):
-            msg = "JSON target language file doesn't exist: %s" % (lang_json_file,)
-            log.error(msg)
-            raise IOError(msg)
+            return self.missing_file("JSON target language file doesn't exist: %s" % (lang_json_file,))
 
-        source_json_file = os.path.join(self.app_locale_dir, sourceFile)
+        source_json_file = os.path.join(locale_dir, sourceFile)
         if not os.path.exists(source_json_file):
-            msg = "JSON source language file doesn't exist: %s" % (source_json_file,)
-            log.error(msg)
-            raise IOError(msg)
+            return self.missing_file("JSON source language file doesn't exist: %s" % (source_json_file,))
 
-        target_fileh = codecs.open(lang_json_file, encoding=self.app_encoding, mode="r")
-        target_data = json.load(target_fileh)
+        if self.is_current(lang_json_file, source_json_file, self.hash_json_file):
+            return None
 
-        source_fileh = codecs.open(source_json_file, encoding=self.app_encoding, mode="r")
-        source_data = json.load(source_fileh)
-        source_fileh.close()
+        if self.json_streaming:
+            # Streamed files are translated in their own batches when the job is finished,
+            # so they don't add anything to the shared plan.
+            def finish_streaming(_plan):
+                translate_json_file(self.translator, lang, source_json_file, lang_json_file, self.app_encoding)
+                log.info("Completed translation of %s" % (targetFile,))
 
-        was_changed, new_data = self.translate_json(lang, source_data, target_data)
-        if was_changed:
-            outfileh = codecs.open(lang_json_file, encoding=self.app_encoding, mode="w")
-            json.dump(new_data, outfileh, ensure_ascii=False, sort_keys=True, indent=4, separators=(',', ': '))
-            outfileh.close()
+            return self.track_job(
+                CatalogJob(lang, lang_json_file, [], finish_streaming), source_json_file, self.hash_json_file)
 
-        log.info("Completed translation of %s" % (targetFile,))
-        return
+        with self.metrics.timer("parse_seconds", lang_json_file):
+            target_fileh = codecs.open(lang_json_file, encoding=self.app_encoding, mode="r")
+            target_data = json.load(target_fileh)
+            target_fileh.close()
 
-    def translate_json(self, locale, source_data, target_data):
+            source_fileh = codecs.open(source_json_file, encoding=self.app_encoding, mode="r")
+            source_data = json.load(source_fileh)
+            source_fileh.close()
+        self.metrics.incr("catalogs_parsed")
 
-        was_changed = False
         out_data = copy.deepcopy(target_data)
+        translate_keys, translate_vals = self.plan_json(source_data, out_data)
 
-        all_keys = sorted(source_data.keys())
-        num_keys = len(all_keys)
-        for start_index, stop_index in get_blocks(num_keys, self.translator.MAX_API_ARRAY):
-            slice_keys = all_keys[start_index:stop_index]
-            if not slice_keys:
-                continue
+        def flush(plan):
+            was_changed = self.apply_json(plan, lang, translate_keys, translate_vals, out_data)
+            if was_changed:
+                with self.metrics.timer("write_seconds", lang_json_file):
+                    with atomic_write(lang_json_file, mode="w", encoding=self.app_encoding) as outfileh:
+                        json.dump(out_data, outfileh, ensure_ascii=False, sort_keys=True, indent=4,
+                                  separators=(',', ': '))
+                self.metrics.incr("catalogs_written")
 
-            translate_keys = []
-            translate_vals = []
-
-            for keyname in slice_keys:
-                source_val = source_data[keyname]
-                if not source_val:
-                    source_val = keyname  # use the key if we have to...?
-                target_val = out_data.get(keyname, '')
-                if target_val:
-                    log.info("already trans: %s -> %s" % (keyname, target_val))
-                    continue
-                translate_keys.append(keyname)
-                translate_vals.append(source_val)
-
-            if not translate_keys:
-                log.info("Nothing to translate in this section? %s:%s" % (start_index, stop_index))
-                continue
+        def finish(plan):
+            flush(plan)
+            log.info("Completed translation of %s" % (targetFile,))
+
+        return self.track_job(
+            CatalogJob(lang, lang_json_file, translate_vals, finish, flush), source_json_file, self.hash_json_file)
+
+    def translate_json(self, locale, source_data, target_data):
+        """
+        :return: (was_changed, new_data) tuple; target_data is not modified.
+        """
+        out_data = copy.deepcopy(target_data)
+        translate_keys, translate_vals = self.plan_json(source_data, out_data)
+        result = {}
+
+        def finish(plan):
+            result['was_changed'] = self.apply_json(plan, locale, translate_keys, translate_vals, out_data)
+
+        self.run_job(CatalogJob(locale, "json", translate_vals, finish))
+        return result['was_changed'], out_data
 
-            result_vals = self.translator.translate_strings(
-                translate_vals, to_lang=locale)
-            log.debug("Got %s new translations for: %s (%s, %s)",
-                      len(result_vals), locale, start_index, stop_index)
+    @staticmethod
+    def plan_json(source_data, out_data):
+        """
+        Find the keys that still need translating.
+
+        :return: (translate_keys, translate_vals) parallel lists.
+        """
+        translate_keys = []
+        translate_vals = []
+        debug = log.isEnabledFor(DEBUG)
+
+        for keyname in sorted(source_data.keys()):
+            source_val = source_data[keyname]
+            if not source_val:
+                source_val = keyname  # use the key if we have to...?
+            target_val = out_data.get(keyname, '')
+            if target_val:
+                if debug:
+                    log.debug("already trans: %s -> %s", keyname, target_val)
+                continue
+            translate_keys.append(keyname)
+            translate_vals.append(source_val)
 
-            for i in range(len(translate_keys)):
-                xkey = translate_keys[i]
-                source_val = translate_vals[i]
-                xval = result_vals.get(source_val, xkey)
-                if xkey == xval:
-                    log.info("Skipping %s -> %s" % (xkey, xkey))
-                    continue
-                log.debug("Translating %s: %s -> %s" % (locale, xkey, xval))
-                out_data[xkey] = xval
-                was_changed = True
+        if not translate_keys:
+            log.info("Nothing to translate.")
+        return translate_keys, translate_vals
 
-        return was_changed, out_data
+    @staticmethod
+    def apply_json(plan, locale, translate_keys, translate_vals, out_data):
+        was_changed = False
+        debug = log.isEnabledFor(DEBUG)
+        for i in range(len(translate_keys)):
+            xkey = translate_keys[i]
+            source_val = translate_vals[i]
+            xval = plan.get(locale, source_val, xkey)
+            if xkey == xval:
+                if debug:
+                    log.debug("Skipping %s -> %s", xkey, xkey)
+                continue
+            if out_data.get(xkey) == xval:
+                continue
+            if not plan.placeholders_ok(locale, source_val):
+                log.warn("Placeholders or markup changed in translation of %s: %s -> %s", xkey, source_val, xval)
+            if debug:
+                log.debug("Translating %s: %s -> %s", locale, xkey, xval)
+            out_data[xkey] = xval
+            was_changed = True
+        return was_changed
+
+    def translate_app_language_mc(self, lang, catalog_domain=None):
+        job = self.plan_app_language_mc(lang, catalog_domain)
+        if job is not None:
+            self.run_job(job)
+        return
 
-    def translate_app_language_mc(self, lang):
-        lang_dir = os.path.join(self.app_locale_dir, lang, "LC_MESSAGES")
-        lang_po_file = os.path.join(lang_dir, "%s.po" % (self.app_domain,))
+    def plan_app_language_mc(self, lang, catalog_domain=None):
+        if catalog_domain is None:
+            catalog_domain = CatalogDomain(self.app_locale_dir, self.app_domain)
+        lang_dir = os.path.join(catalog_domain.locale_dir, lang, "LC_MESSAGES")
+        lang_po_file = os.path.join(lang_dir, "%s.po" % (catalog_domain.domain,))
+        pot_file = self.pot_file(catalog_domain)
 
         def bad_path(pth):
-            msg = """Can't find %s. Maybe you need to run:
-pybabel init -l ja -i /path/to/app/src/locale/myapp.pot -d /path/to/app/src/locale -D myapp""" % (pth,)
-            raise IOError(msg)
+            return self.missing_file("""Can't find %s. Maybe you need to run:
+pybabel init -l ja -i /path/to/app/src/locale/myapp.pot -d /path/to/app/src/locale -D myapp""" % (pth,))
 
         if not os.path.exists(lang_dir):
-            bad_path(lang_dir)
+            return bad_path(lang_dir)
         if not os.path.exists(lang_po_file):
-            bad_path(lang_po_file)
+            return bad_path(lang_po_file)
+
+        if self.is_current(lang_po_file, pot_file, self.hash_pot_file):
+            return None
 
-        input_file = codecs.open(lang_po_file, encoding=self.app_encoding, mode="rb")
-        catalog = read_po(input_file)
-        input_file.close()
+        with self.metrics.timer("parse_seconds", lang_po_file):
+            catalog = self.catalog_io.read(lang_po_file, self.app_encoding)
+        self.metrics.incr("catalogs_parsed")
         log.warn("Opened message catalog: %s", lang_po_file)
-        self.translate_catalog(lang, lang_po_file, catalog)
+        if self.fuzzy_index is not None:
+            self.fuzzy_index.add_catalog(lang, catalog)
+        return self.track_job(
+            self.plan_catalog(lang, lang_po_file, catalog), pot_file, self.hash_pot_file)
 
     def translate_catalog(self, lang, lang_po_file, catalog):
-        changed_file = False
-        for start_index, stop_index in get_blocks(len(catalog), self.translator.MAX_API_ARRAY):
-
-            # noinspection PyProtectedMember
-            def m_slice(cat, start, stop):
-                all_keys = cat._messages.keys()
-                for i in range(start, stop):
-                    key = all_keys[i]
-                    yield key, cat._messages[key]
-
-            dict_array = []
-            for msgId, msg in m_slice(catalog, start_index, stop_index):
-                # log.warn("Message %s", msgId)
-                msg_dict = {
-                    'msgId': msgId,
-                    'message': msg,
-                }
-                if msg.string:
-                    if self.blank_only:
-                        log.warn("Skipping existing: %s => %s", msgId, msg.string)
-                    else:
-                        log.warn("Overwriting existing: %s => %s", msgId, msg.string)
-                        dict_array.append(msg_dict)
-                else:
-                    dict_array.append(msg_dict)
+        self.run_job(self.plan_catalog(lang, lang_po_file, catalog))
+        return
 
-            if not dict_array:
-                log.info("No changes to section (%s, %s) for: %s", start_index, stop_index, lang_po_file)
+    def plan_catalog(self, lang, lang_po_file, catalog):
+        """
+        Find the messages of the catalog that need translating. Messages
+        with a context are handled like any other: the context isn't sent,
+        so they get the same translation as their id without one. The
+        singular and plural ids of pluralized messages are both translated,
+        and fill in the language's plural forms.
+
+        :return: a CatalogJob which updates and writes out the catalog when finished.
+        """
+        pending = PendingMessages.from_catalog(catalog, self.blank_only)
+        if not pending:
+            log.info("No changes to: %s", lang_po_file)
+
+        # Which of the singular and plural translations each of the language's plural forms takes.
+        form_sources = plural_sources(catalog.num_plurals, catalog.plural_expr)
+
+        def finish(plan):
+            changed_file = False
+            # Logging every message is slow in large catalogs, so only do it when it will be seen.
+            debug = log.isEnabledFor(DEBUG)
+            lang_fuzzy = plan.fuzzy.get(lang, {})
+            for message, msgIds, translations in pending.translations(plan, lang):
+                if len(msgIds) > 1:
+                    this_translation = tuple(str(translations[source]) for source in form_sources)
+                    if tuple(message.string or ()) == this_translation:
+                        continue
+                else:
+                    this_translation = str(translations[0])
+                    if message.string == this_translation:
+                        continue
+                if debug:
+                    log.debug("New trans: %s => %s", message.id, this_translation)
+                message.string = this_translation
+                if not all(placeholders_match(msgId, str(translation))
+                           for msgId, translation in zip(msgIds, translations)):
+                    # Fuzzy entries are left out of compiled catalogs until someone reviews them.
+                    log.warn("Placeholders or markup changed in translation, marked fuzzy: %s => %s",
+                             message.id, this_translation)
+                    message.flags.add("fuzzy")
+                    self.metrics.incr("placeholder_errors")
+                if lang_fuzzy:
+                    matched = [lang_fuzzy.get(msgId) for msgId in msgIds]
+                    if any(matched):
+                        # Reused from a similar string; show reviewers which, like msgmerge does.
+                        message.flags.add("fuzzy")
+                        if len(msgIds) == 1:
+                            message.previous_id = [matched[0]]
+                changed_file = True
+
+            if changed_file:
+                log.debug("Finished translating: %s", lang_po_file)
+                self.write_out_catalog(lang_po_file, catalog)
             else:
-                result = self.translator.translate_strings([item['msgId'] for item in dict_array], to_lang=lang)
-                log.debug("Got %s new translations for: %s (%s, %s)", len(result), lang_po_file, start_index, stop_index)
-
-                for msg_dict in dict_array:
-                    msgId = msg_dict['msgId']
-                    message = msg_dict['message']
-                    this_translation = str(result[msgId])
-                    log.info("New trans: %s => %s", msgId, this_translation)
-                    message.string = this_translation
-                    changed_file = True
-
-        if changed_file:
-            log.debug("Finished translating: %s", lang_po_file)
-            self.write_out_catalog(lang_po_file, catalog)
-        else:
-            log.debug("No changes to file: %s", lang_po_file)
+                log.debug("No changes to file: %s", lang_po_file)
 
-    @staticmethod
-    def write_out_catalog(lang_po_file, catalog):
-        with open(lang_po_file, "wb") as output_file:
-            write_po(output_file, catalog)
+        # Finishing only writes out new results, so it can also be used to flush partial results.
+        return CatalogJob(lang, lang_po_file, pending.sources, finish, finish, pending.references)
+
+    def write_out_catalog(self, lang_po_file, catalog):
+        with self.metrics.timer("write_seconds", lang_po_file):
+            self.catalog_io.write(lang_po_file, catalog)
+        self.metrics.incr("catalogs_written")
+        if self.catalog_io.compile_mo:
+            self.metrics.incr("catalogs_compiled")
         log.info("Finished writing new catalog to: %s", lang_po_file)
 
 
 def get_blocks(seq_len, block_size):
     """
     >>> get_blocks(6450, 2000)
-    [(0, 1999), (2000, 3999), (4000, 5999), (6000, 6450)]
+    [(0, 2000), (2000, 4000), (4000, 6000), (6000, 6450)]
+    >>> get_blocks(10, 2000)
+    [(0, 10)]
 
-    :return:
+    :return: list of (start, stop) slice indexes covering a sequence of seq_len.
     """
-    num_blocks = int(seq_len / block_size)
-    if num_blocks == 0:
-        return [(0, seq_len)]
-    rv = []
-    i = 0
-    for block_num in range(num_blocks):
-        rv.append((i, ((block_num + 1) * block_size - 1)))
-        i += block_size
-    new_len = num_blocks * block_size
-    if new_len < seq_len:
-        rv.append((new_len, (seq_len - new_len) + new_len))
-    return rv
+    if seq_len == 0:
+        return [(0, 0)]
+    return [(start, min(start + block_size, seq_len)) for start in range(0, seq_len, block_size)]
 
 
 def test():
@@ -270,15 +645,63 @@ def test():
     eurgh.translate_app_source()
 
 
-def main():
-    try:
-        config_file = sys.argv[1]
-    except KeyError:
-        raise RuntimeError("You must give the config.ini file as the first argument.")
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="eurgh", description=__doc__.strip())
+    parser.add_argument("config_file", help="the config.ini file")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report what would be translated without calling the API or changing files")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an unfinished run, reusing the results in app.journal_file")
+    parser.add_argument("--text", nargs="*", metavar="FILE",
+                        help="translate plain text files (or stdin, if none or -) instead of catalogs")
+    parser.add_argument("--to", metavar="LANG", help="language to translate text into (default: the first to_lang)")
+    parser.add_argument("--output", metavar="FILE", help="write translated text here instead of stdout")
+    parser.add_argument("--paragraphs", action="store_true",
+                        help="translate text by paragraph (separated by blank lines) instead of by line")
+    parser.add_argument("--daemon", action="store_true",
+                        help="serve translate requests from other eurgh runs (translate.backend = daemon)")
+    args = parser.parse_args(argv)
+
+    config_file = args.config_file
     if not os.path.exists(config_file):
         raise IOError("Can't find config file at: %s" % (config_file,))
+    if args.daemon:
+        serve(config_file)
+        return
     eurgh = EurghApp(config_file)
-    eurgh.translate_app_source()
+    if args.text is not None:
+        translate_text_files(eurgh, args.text or ["-"], args.output, args.to, args.paragraphs)
+        return
+    report = eurgh.translate_app_source(dry_run=args.dry_run, resume=args.resume)
+    if args.dry_run:
+        print_report(report)
+
+
+def translate_text_files(eurgh, paths, output=None, to_lang=None, paragraphs=False):
+    encoding = eurgh.app_encoding
+    if output:
+        outfile = codecs.open(output, encoding=encoding, mode="w")
+    else:
+        outfile = sys.stdout
+    try:
+        for path in paths:
+            if path == "-":
+                eurgh.translate_text(sys.stdin, outfile, to_lang, paragraphs)
+            else:
+                with codecs.open(path, encoding=encoding, mode="r") as infile:
+                    eurgh.translate_text(infile, outfile, to_lang, paragraphs)
+    finally:
+        if output:
+            outfile.close()
+    return
+
+
+def print_report(report):
+    width = max(len(key) for key in report)
+    for key, value in report.items():
+        if isinstance(value, dict):
+            value = ", ".join("%s %s" % item for item in value.items())
+        print("%s  %s" % (key.replace("_", " ").ljust(width), value))
 
 
 if __name__ == "__main__":
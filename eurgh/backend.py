@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the translation backend interface and the local backends.
+
+A backend translates batches of strings. The Microsoft Translator client
+(eurgh.translator.EurghTranslator) is one backend; the local backends here
+need no network, which is useful for testing and benchmarking the rest of
+the pipeline at full speed. The backend is chosen with translate.backend.
+"""
+
+from configparser import ConfigParser
+from importlib import import_module
+from logging import getLogger
+import time
+
+from eurgh.batching import DEFAULT_MAX_CHARS, DEFAULT_MAX_STRINGS
+from eurgh.memory import TranslationMemory
+from eurgh.metrics import Metrics
+from eurgh.placeholders import PROTECTED
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+#: Backend names usable in translate.backend; a "module:Class" path also works.
+BACKENDS = {
+    "microsoft": "eurgh.translator:EurghTranslator",
+    "pseudo": "eurgh.backend:PseudoBackend",
+    "identity": "eurgh.backend:IdentityBackend",
+    "daemon": "eurgh.daemon:DaemonBackend",
+}
+
+#: The backend needs network access.
+CAP_NETWORK = "network"
+#: The backend uses translate.category.
+CAP_CATEGORY = "category"
+
+
+def get_backend(config_file):
+    """
+    Create the backend named by translate.backend in the config file.
+    """
+    config = ConfigParser()
+    config.read(config_file)
+    name = config.get("translate", "backend", fallback="microsoft")
+    path = BACKENDS.get(name, name)
+    if ":" not in path:
+        raise ValueError("Unknown translation backend: %s" % (name,))
+    module_name, class_name = path.split(":", 1)
+    backend_class = getattr(import_module(module_name), class_name)
+    log.debug("Using translation backend: %s", path)
+    return backend_class(config_file)
+
+
+class TranslationBackend(object):
+    """
+    Base class of translation backends. Subclasses implement translate_batch.
+    """
+
+    # Max number of strings the backend accepts in one batch.
+    MAX_API_ARRAY = DEFAULT_MAX_STRINGS
+
+    # Max number of characters the backend accepts in one batch.
+    MAX_API_CHARS = DEFAULT_MAX_CHARS
+
+    # Short name of the backend, which keeps its results apart in the translation memory.
+    name = None
+
+    capabilities = frozenset()
+
+    def __init__(self, config_file):
+        self.config = config = ConfigParser()
+        config.read(config_file)
+
+        self.from_lang = config.get("translate", "from_lang")
+        self.to_langs = config.get("translate", "to_lang").split(" ")
+
+        self.api_category = config.get("translate", "category", fallback="general")
+        # Results are remembered (in the translation memory and journal) under this category.
+        self.result_category = "%s/%s" % (self.name or self.__class__.__name__, self.api_category)
+
+        # Send placeholders and markup as short tokens (see eurgh.placeholders).
+        self.mask_placeholders = config.getboolean("translate", "mask_placeholders", fallback=True)
+
+        self.memory = TranslationMemory.from_config(config)
+        self.metrics = Metrics()
+
+        # Limits used when packing strings into batches.
+        self.max_batch_strings = min(
+            config.getint("translate", "max_batch_strings", fallback=self.MAX_API_ARRAY), self.MAX_API_ARRAY)
+        self.max_batch_chars = min(
+            config.getint("translate", "max_batch_chars", fallback=self.MAX_API_CHARS), self.MAX_API_CHARS)
+        return
+
+    def limits(self):
+        """
+        :return: dict of the batch limits in use.
+        """
+        return {
+            "max_strings": self.max_batch_strings,
+            "max_chars": self.max_batch_chars,
+        }
+
+    def translate_batch(self, str_array, from_lang, to_lang):
+        """
+        Translate one batch of strings, which is within the backend's limits.
+
+        :return: dict of source string to translated string.
+        """
+        raise NotImplementedError()
+
+    def translate_string(self, tr_string, from_lang=None, to_lang=None):
+        return self.translate_strings([tr_string], from_lang, to_lang)[tr_string]
+
+    def translate_strings(self, str_array, from_lang=None, to_lang=None):
+        """
+        Translate a list of strings, consulting the translation memory (if
+        configured) before calling the backend.
+
+        :return: dict of source string to translated string.
+        """
+        if len(str_array) > self.MAX_API_ARRAY:
+            raise ValueError(
+                "List is too big to translate, %s is greater than %s" % (len(str_array), self.MAX_API_ARRAY))
+        if from_lang is None:
+            from_lang = self.from_lang
+        if to_lang is None:
+            to_lang = self.to_langs[0]
+
+        self.metrics.incr("strings_requested", len(str_array))
+        if self.memory is None:
+            return self.request_batch(str_array, from_lang, to_lang)
+
+        res = self.memory.lookup(from_lang, to_lang, self.result_category, str_array)
+        self.metrics.incr("memory_hits", len(res))
+        pending = [thing for thing in str_array if thing not in res]
+        if pending:
+            fetched = self.request_batch(pending, from_lang, to_lang)
+            self.memory.store(from_lang, to_lang, self.result_category, fetched)
+            res.update(fetched)
+        return res
+
+    def request_batch(self, str_array, from_lang, to_lang):
+        """
+        Call translate_batch, keeping count of the strings, characters and
+        time it takes.
+        """
+        metrics = self.metrics
+        metrics.incr("requests")
+        metrics.incr("strings_sent", len(str_array))
+        metrics.incr("characters_sent", sum(len(thing) for thing in str_array))
+        try:
+            with metrics.timer("request_seconds"):
+                return self.translate_batch(str_array, from_lang, to_lang)
+        except Exception:
+            metrics.incr("request_errors")
+            raise
+
+
+class LocalBackend(TranslationBackend):
+    """
+    Base of the backends that translate locally. backend.latency (seconds)
+    adds a delay to every batch, to simulate a remote service.
+    """
+
+    MAX_API_ARRAY = 100000
+
+    MAX_API_CHARS = 10000000
+
+    def __init__(self, config_file):
+        super(LocalBackend, self).__init__(config_file)
+        self.latency = self.config.getfloat("backend", "latency", fallback=0.0)
+        return
+
+    def translate_batch(self, str_array, from_lang, to_lang):
+        if self.latency:
+            time.sleep(self.latency)
+        return dict((thing, self.translate_text(thing, to_lang)) for thing in str_array)
+
+    def translate_text(self, text, to_lang):
+        raise NotImplementedError()
+
+
+class IdentityBackend(LocalBackend):
+    """
+    Returns every string unchanged.
+    """
+
+    name = "identity"
+
+    def translate_text(self, text, to_lang):
+        return text
+
+
+_PSEUDO_CHARS = dict(zip(
+    u"abcdeghiklmnorstuwyzABCDEGHIKLNORSTUWYZ",
+    u"áƀçđéğĥíķłɱñóŕšţúŵýžÁßÇĐÉĞĤÍĶŁÑÓŔŠŢÚŴÝŽ"))
+
+
+class PseudoBackend(LocalBackend):
+    """
+    Pseudo-localization: accents the letters and brackets the text, leaving
+    placeholders and markup intact, so untranslated or truncated strings
+    stand out in the application.
+
+    >>> PseudoBackend.pseudo_localize("Hello %(name)s, <b>welcome</b>!", "fr")
+    '[fr: Ĥéłłó %(name)s, <b>ŵéłçóɱé</b>!]'
+    """
+
+    name = "pseudo"
+
+    def translate_text(self, text, to_lang):
+        return self.pseudo_localize(text, to_lang)
+
+    @staticmethod
+    def pseudo_localize(text, to_lang):
+        parts = []
+        pos = 0
+        for match in PROTECTED.finditer(text):
+            parts.append(_pseudo_chars(text[pos:match.start()]))
+            parts.append(match.group())
+            pos = match.end()
+        parts.append(_pseudo_chars(text[pos:]))
+        return u"[%s: %s]" % (to_lang, u"".join(parts))
+
+
+def _pseudo_chars(text):
+    return u"".join(_PSEUDO_CHARS.get(char, char) for char in text)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Packs strings into API request batches.
+
+A batch is limited both by the number of strings and by the total number of
+(XML encoded) characters, which is what the service actually counts.
+Strings too long to fit in any batch are split into pieces first.
+"""
+
+import re
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+# Max number of strings in one TranslateArray request.
+DEFAULT_MAX_STRINGS = 2000
+
+# Max total characters in one TranslateArray request.
+DEFAULT_MAX_CHARS = 10000
+
+# Preferred places to split long strings, best first.
+_SPLIT_PATTERNS = [
+    re.compile(r"\n\s*\n\s*"),  # paragraphs
+    re.compile(r"(?<=[.!?])\s+"),  # sentences
+    re.compile(r"\n\s*"),  # lines
+    re.compile(r"\s+"),  # words
+]
+
+
+def encoded_len(thing):
+    """
+    The length of the string once XML encoded for a request.
+
+    >>> encoded_len("a < b & c")
+    16
+    """
+    return len(thing) + 4 * thing.count("&") + 3 * thing.count("<") + 3 * thing.count(">")
+
+
+def split_text(text, max_chars):
+    """
+    Split text into pieces of at most max_chars encoded characters,
+    preferring paragraph, sentence, line and then word boundaries.
+
+    :return: list of (piece, separator) tuples; joining every piece followed
+        by its separator gives back the original text.
+
+    >>> split_text("One two. Three four.", 10)
+    [('One two.', ' '), ('Three', ' '), ('four.', '')]
+    >>> split_text("abcdef", 4)
+    [('abcd', ''), ('ef', '')]
+    """
+    if encoded_len(text) <= max_chars:
+        return [(text, "")]
+    for pattern in _SPLIT_PATTERNS:
+        matches = [match for match in pattern.finditer(text) if 0 < match.start()]
+        if not matches:
+            continue
+        # Cut at the last boundary that keeps the first piece within the limit,
+        # or the first boundary if there is none.
+        cut = matches[0]
+        for match in matches:
+            if encoded_len(text[:match.start()]) > max_chars:
+                break
+            cut = match
+        head = text[:cut.start()]
+        if encoded_len(head) > max_chars:
+            head_pieces = split_text(head, max_chars)
+            head_pieces[-1] = (head_pieces[-1][0], cut.group())
+        else:
+            head_pieces = [(head, cut.group())]
+        rest = text[cut.end():]
+        if not rest:
+            return head_pieces
+        return head_pieces + split_text(rest, max_chars)
+
+    # No whitespace at all; cut it by length.
+    size = max_chars
+    while size > 1 and encoded_len(text[:size]) > max_chars:
+        size -= 1
+    return [(text[:size], "")] + split_text(text[size:], max_chars)
+
+
+def pack_batches(strings, max_strings=DEFAULT_MAX_STRINGS, max_chars=DEFAULT_MAX_CHARS):
+    """
+    Pack strings into the fewest batches that respect both limits, using
+    first-fit decreasing bin packing. Every string must already fit within
+    max_chars on its own (see split_text).
+
+    :return: list of batches, each a list of strings.
+
+    >>> pack_batches(["aaaa", "bb", "ccc", "d"], max_strings=10, max_chars=5)
+    [['aaaa', 'd'], ['ccc', 'bb']]
+    >>> pack_batches(["a", "b", "c"], max_strings=2)
+    [['a', 'b'], ['c']]
+    """
+    sizes = [encoded_len(thing) for thing in strings]
+    # Sorting is stable, so equal lengths keep their input order.
+    order = sorted(range(len(strings)), key=lambda i: -sizes[i])
+    batches = []
+    # Batches that can still take more strings: [remaining chars, strings list]
+    open_batches = []
+    for i in order:
+        size = sizes[i]
+        if size > max_chars:
+            raise ValueError("String is too long for one request: %s > %s characters" % (size, max_chars))
+        for entry in open_batches:
+            if entry[0] >= size:
+                break
+        else:
+            entry = [max_chars, []]
+            batches.append(entry[1])
+            open_batches.append(entry)
+        entry[0] -= size
+        entry[1].append(strings[i])
+        if len(entry[1]) >= max_strings or entry[0] <= 0:
+            open_batches.remove(entry)
+    return batches
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Benchmarks for the hot paths of Eurgh.
+
+Generates synthetic .po and JSON catalogs and times catalog parsing and
+writing, batching, the TranslateArray XML encoding and decoding, and whole
+runs against a local backend, so no network is needed. Reports throughput,
+run time percentiles, backend request latency and peak memory.
+
+Usage:
+
+    $ python -m eurgh.benchmark --messages 100000 --languages 4
+"""
+
+from collections import OrderedDict
+import argparse
+import codecs
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from logging import ERROR, INFO, basicConfig, getLogger
+
+from babel.messages.catalog import Catalog
+from babel.messages.pofile import read_po, write_po
+
+from eurgh import EurghApp, get_blocks
+from eurgh.batching import pack_batches
+from eurgh.translator import EurghTranslator
+from eurgh.xmlcodec import ARRAYS_NS, SERVICE_NS, decode_array_response
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+LANGS = ["fr", "de", "ja", "es", "it", "nl", "pt", "ru", "ko", "sv", "pl", "tr"]
+
+_WORDS = ("the file could not be saved please try again later your account settings were updated "
+          "delete this item open close cancel next previous search results for name email "
+          "password %(name)s %(count)d {0} <b>bold</b> &amp;").split()
+
+
+def make_strings(count, seed=0):
+    """
+    :return: list of count unique, random, sentence-like strings.
+    """
+    rng = random.Random(seed)
+    rv = []
+    for i in range(count):
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(1, 12))]
+        rv.append("%s %s" % (" ".join(words).capitalize(), i))
+    return rv
+
+
+def make_catalog(strings, locale=None, translated=0.0, seed=0):
+    """
+    :param translated: fraction of the messages which already have a translation.
+    """
+    rng = random.Random(seed)
+    catalog = Catalog(locale=locale)
+    for i, thing in enumerate(strings):
+        string = "~%s" % (thing,) if rng.random() < translated else ""
+        catalog.add(thing, string, locations=[("src/module%s.py" % (i % 50,), i)])
+    return catalog
+
+
+def make_array_response(translations):
+    """
+    :return: a TranslateArray response body, like the service would send.
+    """
+    parts = ['<ArrayOfTranslateArrayResponse xmlns="%s" '
+             'xmlns:i="http://www.w3.org/2001/XMLSchema-instance">' % (SERVICE_NS,)]
+    for thing in translations:
+        thing = thing.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        parts.append(
+            '<TranslateArrayResponse><From>en</From>'
+            '<OriginalTextSentenceLengths xmlns:a="%(ns)s"><a:int>%(len)s</a:int></OriginalTextSentenceLengths>'
+            '<TranslatedText>%(text)s</TranslatedText>'
+            '<TranslatedTextSentenceLengths xmlns:a="%(ns)s"><a:int>%(len)s</a:int></TranslatedTextSentenceLengths>'
+            '</TranslateArrayResponse>' % {"ns": ARRAYS_NS, "len": len(thing), "text": thing})
+    parts.append('</ArrayOfTranslateArrayResponse>')
+    return "".join(parts)
+
+
+def legacy_array_request(str_array, from_lang, to_lang, category="general"):
+    """
+    The TranslateArray request as built before eurgh.xmlcodec, for comparison.
+    """
+    strings_enc = "\n".join([EurghTranslator.serialize(thing) for thing in str_array])
+    data = """\
+<TranslateArrayRequest>
+  <AppId />
+  <From>%s</From>
+  <Options>
+    <Category xmlns="%s" >%s</Category>
+    <ContentType xmlns="%s">text/plain</ContentType>
+  </Options>
+  <Texts>
+    %s
+  </Texts>
+  <To>%s</To>
+</TranslateArrayRequest>""" % (from_lang, SERVICE_NS, category, SERVICE_NS, strings_enc, to_lang)
+    return bytes(data.encode("utf-8"))
+
+
+def percentile(values, pct):
+    """
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * pct / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class Benchmark(object):
+    """
+    Runs the benchmarks in a temporary directory.
+    """
+
+    def __init__(self, messages=10000, languages=3, repeat=3, backend="pseudo", latency=0.0,
+                 translated=0.5, workers=1, processes=0, seed=0):
+        self.messages = messages
+        self.languages = LANGS[:languages]
+        self.repeat = repeat
+        self.backend = backend
+        self.latency = latency
+        self.translated = translated
+        self.workers = workers
+        self.processes = processes
+        self.seed = seed
+        self.results = OrderedDict()
+        self.work_dir = None
+        self.strings = None
+
+    def setup(self):
+        self.work_dir = tempfile.mkdtemp(prefix="eurgh-bench-")
+        self.locale_dir = os.path.join(self.work_dir, "locale")
+        self.strings = make_strings(self.messages, self.seed)
+        self.config_file = os.path.join(self.work_dir, "bench.ini")
+        with codecs.open(self.config_file, encoding="utf-8", mode="w") as fileh:
+            fileh.write("""\
+[translate]
+backend = %s
+from_lang = en
+to_lang = %s
+[secrets]
+client_id = benchmark
+client_secret = benchmark
+[backend]
+latency = %s
+[app]
+locale_dir = %s
+workers = %s
+processes = %s
+json_file_template = %%(domain)s-%%(locale)s.json
+json_source_file = %%(domain)s-en.json
+""" % (self.backend, " ".join(self.languages), self.latency, self.locale_dir, self.workers,
+       self.processes))
+        self.reset_locale_dir()
+        return
+
+    def reset_locale_dir(self):
+        """
+        Write out fresh, partly translated catalogs and JSON files for every language.
+        """
+        if os.path.exists(self.locale_dir):
+            shutil.rmtree(self.locale_dir)
+        os.makedirs(self.locale_dir)
+        for i, lang in enumerate(self.languages):
+            lang_dir = os.path.join(self.locale_dir, lang, "LC_MESSAGES")
+            os.makedirs(lang_dir)
+            catalog = make_catalog(self.strings, lang, self.translated, self.seed + i)
+            with open(os.path.join(lang_dir, "messages.po"), "wb") as fileh:
+                write_po(fileh, catalog)
+            with codecs.open(os.path.join(self.locale_dir, "messages-%s.json" % (lang,)),
+                             encoding="utf-8", mode="w") as fileh:
+                json.dump(dict((thing, "") for thing in self.strings), fileh)
+        with codecs.open(os.path.join(self.locale_dir, "messages-en.json"), encoding="utf-8", mode="w") as fileh:
+            json.dump(dict((thing, thing) for thing in self.strings), fileh)
+        return
+
+    def teardown(self):
+        if self.work_dir:
+            shutil.rmtree(self.work_dir)
+        return
+
+    def measure(self, name, func, setup=None, items=None):
+        """
+        Time func over self.repeat runs, then run it once more to find its
+        peak memory use.
+
+        :param setup: optional function called before each run (not timed);
+            its result is passed to func.
+        :param items: the number of items processed per run, for throughput.
+        """
+        if items is None:
+            items = self.messages
+        durations = []
+        for _ in range(self.repeat):
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            func(arg)
+            durations.append(time.perf_counter() - start)
+
+        arg = setup() if setup else None
+        tracemalloc.start()
+        func(arg)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        median = percentile(durations, 50)
+        self.results[name] = OrderedDict([
+            ("items", items),
+            ("median_s", median),
+            ("p90_s", percentile(durations, 90)),
+            ("min_s", min(durations)),
+            ("items_per_s", items / median if median else 0.0),
+            ("peak_mb", peak / (1024.0 * 1024.0)),
+        ])
+        log.info("%s: %s", name, self.results[name])
+        return
+
+    def run(self, only=None):
+        self.setup()
+        try:
+            benchmarks = OrderedDict([
+                ("read_po", self.bench_read_po),
+                ("write_po", self.bench_write_po),
+                ("get_blocks", self.bench_get_blocks),
+                ("pack_batches", self.bench_pack_batches),
+                ("xml_serialize", self.bench_xml_serialize),
+                ("xml_deserialize", self.bench_xml_deserialize),
+                ("translate_catalog", self.bench_translate_catalog),
+                ("translate_json", self.bench_translate_json),
+                ("end_to_end", self.bench_end_to_end),
+            ])
+            for name, bench in benchmarks.items():
+                if only and name not in only:
+                    continue
+                bench()
+        finally:
+            self.teardown()
+        return self.results
+
+    def lang_po_file(self, lang):
+        return os.path.join(self.locale_dir, lang, "LC_MESSAGES", "messages.po")
+
+    def load_catalog(self, lang=None):
+        with open(self.lang_po_file(lang or self.languages[0]), "rb") as fileh:
+            return read_po(fileh)
+
+    def bench_read_po(self):
+        self.measure("read_po", lambda _arg: self.load_catalog())
+
+    def bench_write_po(self):
+        catalog = self.load_catalog()
+        out_file = os.path.join(self.work_dir, "out.po")
+
+        def write(_arg):
+            with open(out_file, "wb") as fileh:
+                write_po(fileh, catalog)
+
+        self.measure("write_po", write)
+
+    def bench_get_blocks(self):
+        def blocks(_arg):
+            for start, stop in get_blocks(len(self.strings), EurghTranslator.MAX_API_ARRAY):
+                self.strings[start:stop]
+
+        self.measure("get_blocks", blocks)
+
+    def bench_pack_batches(self):
+        self.measure("pack_batches", lambda _arg: pack_batches(self.strings))
+
+    def array_batches(self):
+        return [self.strings[start:stop]
+                for start, stop in get_blocks(len(self.strings), EurghTranslator.MAX_API_ARRAY)]
+
+    def bench_xml_serialize(self):
+        translator = EurghTranslator(self.config_file)
+        batches = self.array_batches()
+
+        def serialize(_arg):
+            for batch in batches:
+                translator.build_array_request(batch, "en", "fr")
+
+        def serialize_legacy(_arg):
+            for batch in batches:
+                legacy_array_request(batch, "en", "fr")
+
+        self.measure("xml_serialize", serialize)
+        self.measure("xml_serialize_legacy", serialize_legacy)
+
+    def bench_xml_deserialize(self):
+        responses = [(batch, make_array_response(batch).encode("utf-8")) for batch in self.array_batches()]
+
+        def deserialize(_arg):
+            for batch, response in responses:
+                EurghTranslator.align_array_result(batch, decode_array_response(response))
+
+        def deserialize_legacy(_arg):
+            for batch, response in responses:
+                EurghTranslator.simplify_array_result(batch, EurghTranslator.deserialize_array(response))
+
+        self.measure("xml_deserialize", deserialize)
+        self.measure("xml_deserialize_legacy", deserialize_legacy)
+
+    def make_app(self, use_json=False):
+        app = EurghApp(self.config_file)
+        app.use_json = use_json
+        self.time_requests(app.translator)
+        return app
+
+    def time_requests(self, translator):
+        """
+        Record the latency of every backend request.
+        """
+        latencies = self.results.setdefault("_latencies", [])
+        translate_batch = translator.translate_batch
+
+        def timed_translate_batch(str_array, from_lang, to_lang):
+            start = time.perf_counter()
+            try:
+                return translate_batch(str_array, from_lang, to_lang)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        translator.translate_batch = timed_translate_batch
+        return
+
+    def bench_translate_catalog(self):
+        app = self.make_app()
+        lang = self.languages[0]
+
+        def setup():
+            self.reset_locale_dir()
+            return self.load_catalog(lang)
+
+        self.measure("translate_catalog",
+                     lambda catalog: app.translate_catalog(lang, self.lang_po_file(lang), catalog), setup)
+
+    def bench_translate_json(self):
+        app = self.make_app(use_json=True)
+        source_data = dict((thing, thing) for thing in self.strings)
+        rng = random.Random(self.seed)
+        target_data = dict((thing, "~" + thing if rng.random() < self.translated else "")
+                           for thing in self.strings)
+        lang = self.languages[0]
+        self.measure("translate_json", lambda _arg: app.translate_json(lang, source_data, target_data))
+
+    def bench_end_to_end(self):
+        self.results["_latencies"] = []
+        app = self.make_app()
+        self.measure("end_to_end", lambda _arg: app.translate_app_source(), self.reset_locale_dir,
+                     items=self.messages * len(self.languages))
+        latencies = self.results["_latencies"]
+        self.results["end_to_end"]["requests"] = len(latencies)
+        for pct in (50, 90, 99):
+            self.results["end_to_end"]["request_p%s_ms" % (pct,)] = percentile(latencies, pct) * 1000.0
+
+
+def print_results(results, stream=None):
+    stream = stream or sys.stdout
+    columns = ["items", "median_s", "p90_s", "min_s", "items_per_s", "peak_mb"]
+    stream.write("%-24s %s\n" % ("benchmark", " ".join("%12s" % (col,) for col in columns)))
+    for name, result in results.items():
+        if name.startswith("_"):
+            continue
+        row = []
+        for col in columns:
+            value = result[col]
+            row.append("%12d" % (value,) if isinstance(value, int) else "%12.4f" % (value,))
+        stream.write("%-24s %s\n" % (name, " ".join(row)))
+        extra = ["%s=%s" % (key, "%.2f" % (value,) if isinstance(value, float) else value)
+                 for key, value in result.items() if key not in columns]
+        if extra:
+            stream.write("%-24s %s\n" % ("", "  ".join(extra)))
+    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="eurgh.benchmark", description="Benchmark Eurgh's hot paths.")
+    parser.add_argument("--messages", type=int, default=10000, help="messages per catalog")
+    parser.add_argument("--languages", type=int, default=3, help="number of target languages (max %s)" % (
+        len(LANGS),))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument("--backend", default="pseudo", help="translation backend to use")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per backend request")
+    parser.add_argument("--translated", type=float, default=0.5,
+                        help="fraction of messages already translated")
+    parser.add_argument("--workers", type=int, default=1, help="app.workers setting")
+    parser.add_argument("--processes", type=int, default=0, help="app.processes setting")
+    parser.add_argument("--only", nargs="*", help="names of the benchmarks to run")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show Eurgh's log messages")
+    args = parser.parse_args(argv)
+    basicConfig(level=INFO if args.verbose else ERROR)
+
+    bench = Benchmark(messages=args.messages, languages=args.languages, repeat=args.repeat,
+                      backend=args.backend, latency=args.latency, translated=args.translated,
+                      workers=args.workers, processes=args.processes)
+    results = bench.run(only=args.only)
+    print_results(results)
+    if args.json:
+        with codecs.open(args.json, encoding="utf-8", mode="w") as fileh:
+            json.dump(dict((key, value) for key, value in results.items() if not key.startswith("_")),
+                      fileh, indent=4)
+    return results
+
+
+if __name__ == "__main__":
+    main()
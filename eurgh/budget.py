@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the character budget of a run.
+
+Translation services bill (and cap) by characters. Rather than translate
+languages in config order until the quota runs out and leave an arbitrary
+subset done, a run can be given a budget: at most so many characters in
+total, and per language. The plan then spends it in priority order, the
+languages listed in budget.priority first, and within a language the
+strings referenced from the most places in the source code first. What
+doesn't fit is left for a later run.
+"""
+
+from logging import getLogger
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+# Prefix of the per-language limits in the [budget] section, like max_chars.ja.
+_LANGUAGE_PREFIX = "max_chars."
+
+
+class CharacterBudget(object):
+    """
+    Limits on the characters a run sends, and the order to spend them in.
+    A limit of 0 means unlimited.
+
+    >>> budget = CharacterBudget(max_chars=100, language_max_chars=60, priority=["ja"])
+    >>> budget.order_languages(["fr", "de", "ja"])
+    ['ja', 'fr', 'de']
+    >>> spending = budget.start()
+    >>> spending.spend("ja", 50), spending.spend("ja", 20), spending.spend("fr", 50)
+    (True, False, True)
+    >>> spending.spend("de", 10), spending.spent
+    (False, 100)
+    """
+
+    def __init__(self, max_chars=0, language_max_chars=0, language_limits=None, priority=None):
+        """
+        :param language_limits: dict of language code -> its own limit,
+            instead of language_max_chars.
+        :param priority: list of languages to translate first, in order.
+        """
+        self.max_chars = max_chars
+        self.language_max_chars = language_max_chars
+        self.language_limits = dict((lang.lower(), limit) for lang, limit in (language_limits or {}).items())
+        self.priority = list(priority or [])
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :return: a CharacterBudget, or None if the config has no [budget] section.
+        """
+        if not config.has_section("budget"):
+            return None
+        language_limits = {}
+        for option in config.options("budget"):
+            if option.startswith(_LANGUAGE_PREFIX):
+                language_limits[option[len(_LANGUAGE_PREFIX):]] = config.getint("budget", option)
+        return cls(
+            max_chars=config.getint("budget", "max_chars", fallback=0),
+            language_max_chars=config.getint("budget", "language_max_chars", fallback=0),
+            language_limits=language_limits,
+            priority=config.get("budget", "priority", fallback="").split(),
+        )
+
+    def language_limit(self, to_lang):
+        return self.language_limits.get(to_lang.lower(), self.language_max_chars)
+
+    def order_languages(self, langs):
+        """
+        :return: the languages in priority order: those in self.priority
+            first, then the rest in their given order.
+        """
+        langs = list(langs)
+        first = [lang for lang in self.priority if lang in langs]
+        return first + [lang for lang in langs if lang not in first]
+
+    def start(self):
+        return BudgetSpending(self)
+
+
+class BudgetSpending(object):
+    """
+    The characters spent so far against a budget.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.spent = 0
+        # to_lang -> characters spent
+        self.language_spent = {}
+
+    def spend(self, to_lang, chars):
+        """
+        Spend chars on the language, if both its limit and the run's allow.
+
+        :return: True if spent.
+        """
+        budget = self.budget
+        language_spent = self.language_spent.get(to_lang, 0)
+        language_limit = budget.language_limit(to_lang)
+        if budget.max_chars and self.spent + chars > budget.max_chars:
+            return False
+        if language_limit and language_spent + chars > language_limit:
+            return False
+        self.spent += chars
+        self.language_spent[to_lang] = language_spent + chars
+        return True
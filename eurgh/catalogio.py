@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Reading and writing .po message catalogs, optionally in a pool of processes.
+
+babel's read_po and write_po are pure Python and CPU bound, so threads don't
+help with them. With app.processes set, catalogs are parsed and written in
+worker processes instead, so several catalogs are handled at once and the
+main process is free to keep API requests going.
+
+Written catalogs can also be compiled to .mo files (app.compile_mo) and to
+compact JSON bundles for JavaScript (app.json_bundle) straight from memory,
+in the same worker, rather than by parsing the .po files again afterwards.
+"""
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+import codecs
+import json
+import os
+import struct
+import threading
+
+from babel.messages.mofile import LE_MAGIC
+from babel.messages.pofile import read_po, write_po
+
+from eurgh.files import atomic_write
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+
+def read_catalog(path, encoding="utf-8"):
+    """
+    :return: the babel Catalog in the .po file at path.
+    """
+    with codecs.open(path, encoding=encoding, mode="rb") as input_file:
+        return read_po(input_file)
+
+
+def write_catalog(path, catalog, compile_mo=False, json_bundle=False):
+    """
+    Write the catalog to path atomically, through a temporary file. The
+    previous msgids of fuzzy messages (#| comments) are kept.
+
+    :param compile_mo: also write the compiled .mo file next to it.
+    :param json_bundle: also write a JSON bundle of it next to it.
+    """
+    with atomic_write(path) as output_file:
+        write_po(output_file, catalog, include_previous=True)
+    base_path = os.path.splitext(path)[0]
+    if compile_mo:
+        with atomic_write(base_path + ".mo") as output_file:
+            output_file.write(compile_catalog(catalog))
+    if json_bundle:
+        with atomic_write(base_path + ".json", mode="w", encoding="utf-8") as output_file:
+            json.dump(catalog_bundle(catalog), output_file, ensure_ascii=False, sort_keys=True,
+                      separators=(",", ":"))
+    return
+
+
+def _mo_order(message):
+    # The order of babel's Message comparisons.
+    return message.id[0] if message.pluralizable else message.id, message.context or ""
+
+
+def compile_catalog(catalog, use_fuzzy=False):
+    """
+    Compile a catalog to the GNU .mo format. The output is the same as
+    babel's write_mo, which takes time quadratic in the catalog's size
+    (it builds the string tables by concatenating bytes).
+
+    :param use_fuzzy: include fuzzy translations.
+    :return: bytes of the .mo file.
+    """
+    charset = catalog.charset
+    messages = list(catalog)
+    messages[1:] = [message for message in messages[1:] if message.string and (use_fuzzy or not message.fuzzy)]
+    messages.sort(key=_mo_order)
+
+    ids = []
+    strs = []
+    ids_len = strs_len = 0
+    key_offsets = array("i")
+    value_offsets = array("i")
+    for message in messages:
+        if message.pluralizable:
+            msgid = b"\x00".join(part.encode(charset) for part in message.id)
+            # Missing forms fall back to the singular or plural id, as gettext would.
+            msgstr = b"\x00".join((string or message.id[min(index, 1)]).encode(charset)
+                                  for index, string in enumerate(message.string))
+        else:
+            msgid = message.id.encode(charset)
+            msgstr = message.string.encode(charset)
+        if message.context:
+            msgid = message.context.encode(charset) + b"\x04" + msgid
+        key_offsets.extend((len(msgid), ids_len))
+        value_offsets.extend((len(msgstr), strs_len))
+        ids.append(msgid + b"\x00")
+        strs.append(msgstr + b"\x00")
+        ids_len += len(msgid) + 1
+        strs_len += len(msgstr) + 1
+
+    # A 7 integer header, the key and value tables, then the keys and values; no hash table.
+    key_start = 7 * 4 + 16 * len(messages)
+    value_start = key_start + ids_len
+    for i in range(1, len(key_offsets), 2):
+        key_offsets[i] += key_start
+        value_offsets[i] += value_start
+    header = struct.pack("Iiiiiii", LE_MAGIC, 0, len(messages), 7 * 4, 7 * 4 + len(messages) * 8, 0, 0)
+    return b"".join([header, key_offsets.tobytes(), value_offsets.tobytes()] + ids + strs)
+
+
+def catalog_bundle(catalog):
+    """
+    The translated, non-fuzzy messages of a catalog, like a .mo file: keyed
+    by msgid, or by context and msgid joined by EOT, with a list of forms for
+    pluralized messages.
+
+    >>> from babel.messages.catalog import Catalog
+    >>> catalog = Catalog(locale="fr")
+    >>> _ = catalog.add("Hello", "Bonjour")
+    >>> _ = catalog.add("Open", "Ouvrir", context="menu")
+    >>> _ = catalog.add("Close", "Fermer", flags=["fuzzy"])
+    >>> _ = catalog.add(("file", "files"), ("fichier", "fichiers"))
+    >>> sorted(catalog_bundle(catalog)["messages"].items())
+    [('Hello', 'Bonjour'), ('file', ['fichier', 'fichiers']), ('menu\\x04Open', 'Ouvrir')]
+
+    :return: dict of the locale, plural forms expression and messages.
+    """
+    messages = {}
+    for message in catalog:
+        if not message.id or message.fuzzy or not message.string:
+            continue
+        if message.pluralizable:
+            if not all(message.string):
+                continue
+            msgid, translation = message.id[0], list(message.string)
+        else:
+            msgid, translation = message.id, message.string
+        if message.context:
+            msgid = "%s\x04%s" % (message.context, msgid)
+        messages[msgid] = translation
+    return {
+        "locale": str(catalog.locale) if catalog.locale else None,
+        "plural_forms": catalog.plural_forms,
+        "messages": messages,
+    }
+
+
+class CatalogIO(object):
+    """
+    Reads and writes catalogs, in up to `processes` worker processes; with
+    0 processes it's all done in the calling thread. Callers get parallelism
+    by calling from several threads at once.
+    """
+
+    def __init__(self, processes=0, compile_mo=False, json_bundle=False):
+        """
+        :param compile_mo: write the .mo file of every catalog written.
+        :param json_bundle: write a JSON bundle of every catalog written.
+        """
+        self.processes = processes
+        self.compile_mo = compile_mo
+        self.json_bundle = json_bundle
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            processes=config.getint("app", "processes", fallback=0),
+            compile_mo=config.getboolean("app", "compile_mo", fallback=False),
+            json_bundle=config.getboolean("app", "json_bundle", fallback=False),
+        )
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                log.debug("Starting %s catalog processes", self.processes)
+                self._pool = ProcessPoolExecutor(max_workers=self.processes)
+            return self._pool
+
+    def read(self, path, encoding="utf-8"):
+        if self.processes <= 0:
+            return read_catalog(path, encoding)
+        return self._get_pool().submit(read_catalog, path, encoding).result()
+
+    def write(self, path, catalog):
+        if self.processes <= 0:
+            return write_catalog(path, catalog, self.compile_mo, self.json_bundle)
+        return self._get_pool().submit(write_catalog, path, catalog, self.compile_mo, self.json_bundle).result()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+        return
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+A compact, index-based view of the messages of a catalog which need
+translating.
+
+It is built in one pass over the catalog's public interface and holds
+parallel arrays instead of a record per message: the babel Message
+objects, a flat list of every source string (singular and plural ids of
+pluralized messages included), the offset of each message's first source
+string in that list, and the number of places each source string is used
+in the source code.
+"""
+
+from array import array
+from logging import DEBUG, getLogger
+
+from eurgh.plurals import is_translated, message_ids
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+
+class PendingMessages(object):
+    """
+    The messages of a catalog to be translated.
+
+    >>> from babel.messages.catalog import Catalog
+    >>> catalog = Catalog(locale="fr")
+    >>> catalog.add("Hello", "Bonjour")
+    <Message 'Hello' (flags: [])>
+    >>> catalog.add(("file", "files"))
+    <Message ('file', 'files') (flags: [])>
+    >>> catalog.add("Open", context="menu")
+    <Message 'Open' (flags: [])>
+    >>> pending = PendingMessages.from_catalog(catalog)
+    >>> len(pending), pending.sources
+    (2, ['file', 'files', 'Open'])
+    >>> pending.message_sources(0)
+    ['file', 'files']
+    """
+
+    __slots__ = ("messages", "sources", "starts", "references")
+
+    def __init__(self):
+        # The babel Message objects.
+        self.messages = []
+        # Every source string, in order; message i's are sources[starts[i]:starts[i + 1]].
+        self.sources = []
+        self.starts = array("L", [0])
+        # Parallel to sources: the number of locations of its message.
+        self.references = array("L")
+
+    @classmethod
+    def from_catalog(cls, catalog, blank_only=True):
+        """
+        :param blank_only: leave out messages which already have a translation.
+        """
+        self = cls()
+        messages = self.messages
+        sources = self.sources
+        starts = self.starts
+        references = self.references
+        debug = log.isEnabledFor(DEBUG)
+        for message in catalog:
+            if not message.id:
+                # The header
+                continue
+            if is_translated(message):
+                if blank_only:
+                    if debug:
+                        log.debug("Skipping existing: %s => %s", message.id, message.string)
+                    continue
+                if debug:
+                    log.debug("Overwriting existing: %s => %s", message.id, message.string)
+            messages.append(message)
+            ids = message_ids(message)
+            sources.extend(ids)
+            starts.append(len(sources))
+            references.extend([len(message.locations)] * len(ids))
+        return self
+
+    def __len__(self):
+        return len(self.messages)
+
+    def message_sources(self, index):
+        """
+        :return: list of the source strings of message number index.
+        """
+        return self.sources[self.starts[index]:self.starts[index + 1]]
+
+    def translations(self, plan, to_lang):
+        """
+        :return: iterator of (message, list of its source strings, list of
+            their translations) for the messages with all their translations
+            in the plan. Pluralized messages are those with several sources.
+        """
+        lang_results = plan.results.get(to_lang, {})
+        sources = self.sources
+        starts = self.starts
+        for index, message in enumerate(self.messages):
+            start = starts[index]
+            stop = starts[index + 1]
+            if stop - start == 1:
+                source = sources[start]
+                translation = lang_results.get(source)
+                if translation is not None:
+                    yield message, (source,), (translation,)
+                continue
+            message_sources = sources[start:stop]
+            translations = [lang_results.get(source) for source in message_sources]
+            if None not in translations:
+                yield message, message_sources, translations
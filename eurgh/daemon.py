@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the translation daemon and its client backend.
+
+Started with ``python -m eurgh daemon.ini --daemon``, the daemon keeps one
+translation backend (with its access token, connections and translation
+memory) and serves translate requests over HTTP on localhost. Requests
+from any number of clients which arrive within a short window (daemon.window
+seconds) are coalesced, with duplicate strings removed, into full batches,
+and each client gets back just its own results.
+
+Clients use it by setting translate.backend = daemon; each eurgh run then
+pays for no authentication and its small requests share batches with every
+other run's.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from logging.config import fileConfig
+import json
+import signal
+import threading
+import time
+
+# noinspection PyUnresolvedReferences
+from six.moves.urllib.parse import urljoin, urlsplit
+
+from eurgh.backend import TranslationBackend, get_backend
+from eurgh.batching import encoded_len, pack_batches
+from eurgh.transport import ConnectionPool
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+DEFAULT_URL = "http://127.0.0.1:8765/"
+
+# Default seconds to wait for more strings before sending a batch.
+DEFAULT_WINDOW = 0.05
+
+# Default number of batches sent at once, for backends without translate.max_in_flight.
+DEFAULT_WORKERS = 4
+
+
+class _Waiter(object):
+    """
+    One client request, waiting for the translations of its strings.
+    """
+
+    def __init__(self, strings):
+        self.results = {}
+        self.remaining = set(strings)
+        self.error = None
+        self.done = threading.Event()
+        if not self.remaining:
+            self.done.set()
+
+    def deliver(self, string, translation):
+        # Called with the batcher's lock held.
+        self.results[string] = translation
+        self.remaining.discard(string)
+        if not self.remaining:
+            self.done.set()
+        return
+
+    def fail(self, error):
+        self.error = error
+        self.done.set()
+        return
+
+
+class MicroBatcher(object):
+    """
+    Coalesces the strings of concurrent translate() calls into batches.
+
+    A batch is sent once the oldest waiting string has waited `window`
+    seconds, or as soon as a full batch's worth is waiting. A string
+    already being translated for another caller isn't sent again.
+    """
+
+    def __init__(self, backend, window=DEFAULT_WINDOW, workers=None):
+        self.backend = backend
+        self.window = window
+        self.workers = workers or getattr(backend, "max_in_flight", DEFAULT_WORKERS)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._cond = threading.Condition()
+        # (from_lang, to_lang) -> OrderedDict of string -> list of waiters, not sent yet
+        self._pending = OrderedDict()
+        # (from_lang, to_lang) -> characters pending
+        self._pending_chars = {}
+        # (from_lang, to_lang) -> dict of string -> list of waiters, being translated
+        self._in_flight = {}
+        # When the oldest pending string arrived, if any.
+        self._oldest = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="eurgh-batcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config, backend):
+        return cls(
+            backend,
+            window=config.getfloat("daemon", "window", fallback=DEFAULT_WINDOW),
+            workers=config.getint("daemon", "workers", fallback=0) or None,
+        )
+
+    def translate(self, strings, from_lang, to_lang, timeout=None):
+        """
+        Translate strings along with everyone else's.
+
+        :raises ValueError: if a string is too long for a batch.
+        :return: dict of source string to translated string.
+        """
+        max_chars = self.backend.max_batch_chars
+        for string in strings:
+            if encoded_len(string) > max_chars:
+                raise ValueError("String is too long for one request: %s > %s characters" % (
+                    encoded_len(string), max_chars))
+        waiter = _Waiter(strings)
+        key = (from_lang, to_lang)
+        with self._cond:
+            if self._closed:
+                raise ValueError("The batcher is closed.")
+            pending = self._pending.setdefault(key, OrderedDict())
+            in_flight = self._in_flight.setdefault(key, {})
+            for string in waiter.remaining:
+                if string in in_flight:
+                    in_flight[string].append(waiter)
+                    continue
+                if string not in pending:
+                    pending[string] = []
+                    self._pending_chars[key] = self._pending_chars.get(key, 0) + encoded_len(string)
+                pending[string].append(waiter)
+            if self._oldest is None and any(self._pending.values()):
+                self._oldest = time.time()
+            self._cond.notify()
+        if not waiter.done.wait(timeout):
+            raise IOError("Timed out waiting for %s translations" % (len(waiter.remaining),))
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.results
+
+    def _batch_ready(self):
+        backend = self.backend
+        for key, pending in self._pending.items():
+            if len(pending) >= backend.max_batch_strings or \
+                    self._pending_chars.get(key, 0) >= backend.max_batch_chars:
+                return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._oldest is None and not self._closed:
+                    self._cond.wait()
+                while self._oldest is not None and not self._closed and not self._batch_ready():
+                    remaining = self._oldest + self.window - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._oldest is None and self._closed:
+                    return
+                batches = self._take_batches()
+            for key, batch in batches:
+                self._executor.submit(self._send, key, batch)
+
+    def _take_batches(self):
+        """
+        Move every pending string in flight.
+
+        :return: list of ((from_lang, to_lang), list of strings) batches.
+        """
+        rv = []
+        for key, pending in self._pending.items():
+            if not pending:
+                continue
+            self._in_flight.setdefault(key, {}).update(pending)
+            for batch in pack_batches(list(pending.keys()), self.backend.max_batch_strings,
+                                      self.backend.max_batch_chars):
+                rv.append((key, batch))
+        self._pending.clear()
+        self._pending_chars.clear()
+        self._oldest = None
+        return rv
+
+    def _send(self, key, batch):
+        from_lang, to_lang = key
+        try:
+            results = self.backend.translate_strings(batch, from_lang, to_lang)
+            error = None
+        except Exception as e:
+            log.error("Batch of %s strings into %s failed: %s", len(batch), to_lang, e)
+            results = {}
+            error = e
+        with self._cond:
+            in_flight = self._in_flight[key]
+            for string in batch:
+                for waiter in in_flight.pop(string, ()):
+                    if error is None and string in results:
+                        waiter.deliver(string, results[string])
+                    else:
+                        waiter.fail(error or IOError("No translation returned for: %s" % (string,)))
+        return
+
+    def close(self):
+        """
+        Send whatever is pending, and stop.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        return
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /translate with a JSON object of from_lang (optional), to_lang and
+    strings returns a JSON object whose translations are in the same order.
+    GET /limits returns the batch limits, and GET /metrics the daemon's
+    metrics in the Prometheus text format.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/limits":
+            self.send_body(200, json.dumps(server.backend.limits()).encode("utf-8"), "application/json")
+        elif self.path == "/metrics":
+            self.send_body(200, server.backend.metrics.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self.send_json(404, {"error": "Not found: %s" % (self.path,)})
+
+    def do_POST(self):
+        if self.path != "/translate":
+            self.send_json(404, {"error": "Not found: %s" % (self.path,)})
+            return
+        server = self.server
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            strings = request["strings"]
+            to_lang = request["to_lang"]
+            from_lang = request.get("from_lang") or server.backend.from_lang
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": "Bad request: %s" % (e,)})
+            return
+        server.metrics.incr("client_requests")
+        server.metrics.incr("client_strings", len(strings))
+        try:
+            results = server.batcher.translate(strings, from_lang, to_lang)
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.send_json(502, {"error": "Translation failed: %s" % (e,)})
+            return
+        self.send_json(200, {"translations": [results[string] for string in strings]})
+
+    def send_json(self, status, obj):
+        self.send_body(status, json.dumps(obj, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug("%s %s", self.address_string(), fmt % args)
+
+
+def make_server(config_file):
+    """
+    :return: the daemon's HTTP server, ready to serve_forever().
+    """
+    config = ConfigParser()
+    config.read(config_file)
+    backend = get_backend(config_file)
+    if isinstance(backend, DaemonBackend):
+        raise ValueError("The daemon can't use the daemon backend; set translate.backend to a real one.")
+    parts = urlsplit(config.get("daemon", "url", fallback=DEFAULT_URL))
+    server = ThreadingHTTPServer((parts.hostname, parts.port or 80), DaemonRequestHandler)
+    server.daemon_threads = True
+    server.backend = backend
+    # Client requests are counted along with the backend's batches.
+    server.metrics = backend.metrics
+    server.batcher = MicroBatcher.from_config(config, backend)
+    return server
+
+
+def serve(config_file):
+    """
+    Run the daemon until interrupted or terminated.
+    """
+    config = ConfigParser()
+    config.read(config_file)
+    if config.has_section("loggers"):
+        fileConfig(config_file, disable_existing_loggers=False)
+    server = make_server(config_file)
+    host, port = server.server_address[:2]
+    log.warn("Eurgh daemon listening on http://%s:%s/ (window %.3f seconds)", host, port, server.batcher.window)
+
+    def terminate(_signum, _frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.warn("Shutting down.")
+    finally:
+        server.server_close()
+        server.batcher.close()
+    return
+
+
+class DaemonBackend(TranslationBackend):
+    """
+    Sends batches to a running eurgh daemon (daemon.url), which coalesces
+    them with other clients' into full batches for its own backend.
+    """
+
+    # The daemon repacks what it gets, so larger batches just mean fewer round trips.
+    MAX_API_ARRAY = 100000
+
+    name = "daemon"
+
+    def __init__(self, config_file):
+        super(DaemonBackend, self).__init__(config_file)
+        self.url = self.config.get("daemon", "url", fallback=DEFAULT_URL)
+        self.transport = ConnectionPool.from_config(self.config, self.metrics)
+        # Strings must fit in one of the daemon's batches.
+        try:
+            limits = json.loads(self.transport.request("GET", urljoin(self.url, "limits")).text())
+        except (OSError, ValueError) as e:
+            raise IOError("Can't reach the eurgh daemon at %s (start one with --daemon): %s" % (self.url, e))
+        self.max_batch_chars = min(self.max_batch_chars, limits["max_chars"])
+        return
+
+    def translate_batch(self, str_array, from_lang, to_lang):
+        data = json.dumps({"from_lang": from_lang, "to_lang": to_lang, "strings": list(str_array)})
+        response = self.transport.request("POST", urljoin(self.url, "translate"), data.encode("utf-8"),
+                                          {"Content-Type": "application/json"})
+        translations = json.loads(response.text())["translations"]
+        return dict(zip(str_array, translations))
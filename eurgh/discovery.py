@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Finds the message catalogs (or JSON files) of many locale directories and
+domains, so a whole source tree can be translated in a single run.
+
+Locale directories are given as glob patterns (app.locale_dirs), and the
+domains either listed (app.domains) or found from the .po and .pot files
+(or JSON source files) present when app.domains is *.
+"""
+
+from collections import namedtuple
+from glob import glob
+from logging import getLogger
+import os
+import re
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+#: One domain's catalogs (or JSON files) in one locale directory.
+CatalogDomain = namedtuple("CatalogDomain", ["locale_dir", "domain"])
+
+#: app.domains value meaning every domain found.
+ALL_DOMAINS = "*"
+
+
+def expand_locale_dirs(patterns):
+    """
+    :param patterns: list of directory glob patterns.
+    :return: sorted list of the existing directories matched, without duplicates.
+    """
+    rv = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(path for path in glob(os.path.expanduser(pattern)) if os.path.isdir(path))
+        if not matches:
+            log.warn("No locale directories match: %s", pattern)
+        for path in matches:
+            path = os.path.normpath(path)
+            if path not in seen:
+                seen.add(path)
+                rv.append(path)
+    return rv
+
+
+def find_po_domains(locale_dir):
+    """
+    :return: sorted list of the domains with a .pot template or .po catalog in locale_dir.
+    """
+    paths = glob(os.path.join(locale_dir, "*.pot")) + glob(os.path.join(locale_dir, "*", "LC_MESSAGES", "*.po"))
+    return sorted(set(os.path.splitext(os.path.basename(path))[0] for path in paths))
+
+
+def template_pattern(template):
+    """
+    Turn a file name template such as %(domain)s-en.json into a regular
+    expression which captures the domain.
+
+    >>> template_pattern("%(domain)s-en.json").match("admin-en.json").group("domain")
+    'admin'
+    """
+    parts = template.split("%(domain)s")
+    if len(parts) < 2:
+        raise ValueError("The JSON source file template has no %%(domain)s: %s" % (template,))
+    domain_group = "(?P<domain>[^/\\\\]+?)"
+    pattern = re.escape(parts[0]) + domain_group
+    for part in parts[1:-1]:
+        pattern += re.escape(part) + "(?P=domain)"
+    pattern += re.escape(parts[-1])
+    return re.compile(pattern + "$")
+
+
+def find_json_domains(locale_dir, source_template):
+    """
+    :param source_template: the app.json_source_file template, uninterpolated.
+    :return: sorted list of the domains with a JSON source file in locale_dir.
+    """
+    pattern = template_pattern(source_template)
+    rv = set()
+    for name in os.listdir(locale_dir):
+        match = pattern.match(name)
+        if match:
+            rv.add(match.group("domain"))
+    return sorted(rv)
+
+
+def discover(locale_dir_patterns, domains, json_source_template=None):
+    """
+    :param domains: list of domain names, or [ALL_DOMAINS] to find them.
+    :param json_source_template: find JSON domains with this template instead of .po ones.
+    :return: list of CatalogDomain.
+    """
+    rv = []
+    for locale_dir in expand_locale_dirs(locale_dir_patterns):
+        if domains == [ALL_DOMAINS]:
+            if json_source_template:
+                found = find_json_domains(locale_dir, json_source_template)
+            else:
+                found = find_po_domains(locale_dir)
+        else:
+            found = domains
+        for domain in found:
+            rv.append(CatalogDomain(locale_dir, domain))
+    log.info("Found %s domains in %s locale directories", len(rv), len(set(item.locale_dir for item in rv)))
+    return rv
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+File handling helpers.
+"""
+
+from contextlib import contextmanager
+import io
+import os
+import tempfile
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+# Permissions for newly created files, honoring the process umask.
+_umask = os.umask(0)
+os.umask(_umask)
+NEW_FILE_MODE = 0o666 & ~_umask
+
+
+@contextmanager
+def atomic_write(path, mode="wb", encoding=None, file_mode=None):
+    """
+    Open a temporary file next to path for writing, and rename it over path
+    once the block completes. If the block raises, path is left untouched.
+
+    :param file_mode: permissions of the file; by default those of the
+        existing file, or the usual ones for a new file.
+
+    >>> with atomic_write("/tmp/eurgh-atomic.txt", mode="w", encoding="utf-8") as fileh:
+    ...     _ = fileh.write("Hello")
+    >>> open("/tmp/eurgh-atomic.txt").read()
+    'Hello'
+    """
+    dir_name, base_name = os.path.split(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=dir_name, prefix=".%s." % (base_name,), suffix=".tmp")
+    try:
+        with io.open(fd, mode=mode, encoding=encoding) as fileh:
+            yield fileh
+        if file_mode is not None:
+            os.chmod(temp_path, file_mode)
+        elif os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        else:
+            os.chmod(temp_path, NEW_FILE_MODE)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return
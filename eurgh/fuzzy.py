@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Fuzzy reuse of existing translations.
+
+Every reviewed translation in the catalogs loaded during a run goes into a
+trigram index, per language. Strings that still need translating are looked
+up in it first: one close enough to an already translated string (differing
+in case, punctuation, a trailing colon or a word) takes its translation,
+flagged fuzzy for review, instead of being sent to the translation service.
+
+Similarity is the Dice coefficient of the strings' trigram sets, after
+lowercasing, collapsing whitespace and dropping trailing punctuation. A
+match must also have the same placeholders and markup as the query.
+"""
+
+from collections import Counter
+from logging import getLogger
+import math
+import threading
+
+from eurgh.placeholders import placeholders_match
+from eurgh.plurals import is_translated
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+#: Default minimum similarity (0 to 1) of a fuzzy match.
+DEFAULT_THRESHOLD = 0.8
+
+# Characters ignored at the end of a string.
+_TRAILING = " .:;!?…"
+
+
+def normalize(text):
+    """
+    >>> normalize("  Save   File: ")
+    'save file'
+    """
+    return " ".join(text.lower().split()).rstrip(_TRAILING)
+
+
+def trigrams(text):
+    """
+    :return: set of the trigrams of a normalized string, padded so that
+        short strings and word starts count too.
+
+    >>> sorted(trigrams("ok"))
+    ['  o', ' ok', 'ok ']
+    """
+    padded = "  %s " % (text,)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(grams, other_grams):
+    """
+    :return: the Dice coefficient of two trigram sets.
+
+    >>> round(similarity(trigrams("save file"), trigrams("save files")), 2)
+    0.86
+    """
+    if not grams or not other_grams:
+        return 0.0
+    return 2.0 * len(grams & other_grams) / (len(grams) + len(other_grams))
+
+
+def min_overlap(size, threshold):
+    """
+    :return: the fewest trigrams a set of size trigrams can share with any
+        set at least threshold similar to it.
+    """
+    return int(math.ceil(threshold * size / (2.0 - threshold) - 1e-9))
+
+
+class _LanguageIndex(object):
+    """
+    The translated strings of one language.
+
+    Trigrams are ordered from rarest to most common, and each entry is only
+    posted under the first few of its trigrams (its prefix), so many that
+    two sets similar enough must share one. Common trigrams then never make
+    candidates, and the postings are built once all entries are added.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        # Parallel lists: source string, its translation, its trigram set
+        # and that set's size.
+        self.sources = []
+        self.translations = []
+        self.grams = []
+        self.sizes = []
+        # normalized source string -> entry number
+        self.exact = {}
+        # trigram -> number of entries having it
+        self.frequency = Counter()
+        # trigram -> list of entry numbers; None until built.
+        self.postings = None
+
+    def add(self, source, translation):
+        key = normalize(source)
+        if not key or key in self.exact:
+            return
+        grams = trigrams(key)
+        self.exact[key] = len(self.sources)
+        self.sources.append(source)
+        self.translations.append(translation)
+        self.grams.append(grams)
+        self.sizes.append(len(grams))
+        self.frequency.update(grams)
+        self.postings = None
+        return
+
+    def prefix(self, grams):
+        frequency = self.frequency
+        ordered = sorted(grams, key=lambda gram: (frequency.get(gram, 0), gram))
+        return ordered[:len(grams) - min_overlap(len(grams), self.threshold) + 1]
+
+    def build(self):
+        postings = {}
+        for entry, grams in enumerate(self.grams):
+            for gram in self.prefix(grams):
+                postings.setdefault(gram, []).append(entry)
+        self.postings = postings
+        return
+
+    def candidates(self, key, grams):
+        """
+        :return: list of (score, entry number) of the entries at least
+            threshold similar to the query, best first.
+        """
+        entry = self.exact.get(key)
+        if entry is not None:
+            return [(1.0, entry)]
+        threshold = self.threshold
+        size = len(grams)
+        # A match's trigram set can only be so much smaller or larger.
+        min_size = min_overlap(size, threshold)
+        max_size = int(math.floor(size * (2.0 - threshold) / threshold + 1e-9))
+        postings = self.postings
+        sizes = self.sizes
+        entry_grams = self.grams
+        rv = []
+        for entry in set().union(*[postings.get(gram, ()) for gram in self.prefix(grams)]):
+            entry_size = sizes[entry]
+            if min_size <= entry_size <= max_size:
+                score = 2.0 * len(grams & entry_grams[entry]) / (size + entry_size)
+                if score >= threshold:
+                    rv.append((score, entry))
+        rv.sort(key=lambda item: (-item[0], item[1]))
+        return rv
+
+
+class FuzzyIndex(object):
+    """
+    Reviewed translations of every language, looked up by similarity.
+
+    >>> index = FuzzyIndex(threshold=0.8)
+    >>> index.add("fr", "Save the file", "Enregistrer le fichier")
+    >>> index.match("fr", "Save the file:")
+    ('Enregistrer le fichier', 'Save the file', 1.0)
+    >>> index.match("fr", "Save the files")[0]
+    'Enregistrer le fichier'
+    >>> index.match("fr", "Open the file") is None
+    True
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("The fuzzy match threshold must be between 0 and 1, not %s" % (threshold,))
+        self.threshold = threshold
+        # to_lang -> _LanguageIndex
+        self.languages = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :return: a FuzzyIndex, or None if fuzzy reuse isn't enabled.
+        """
+        if not config.getboolean("fuzzy", "enabled", fallback=False):
+            return None
+        return cls(threshold=config.getfloat("fuzzy", "threshold", fallback=DEFAULT_THRESHOLD))
+
+    def add(self, to_lang, source, translation):
+        with self._lock:
+            language = self.languages.get(to_lang)
+            if language is None:
+                language = self.languages[to_lang] = _LanguageIndex(self.threshold)
+            language.add(source, translation)
+        return
+
+    def add_catalog(self, to_lang, catalog):
+        """
+        Index the reviewed translations of a catalog: those which aren't
+        fuzzy. Only the singular ids of pluralized messages are used.
+
+        :return: number of messages indexed.
+        """
+        count = 0
+        for message in catalog:
+            if not message.id or message.fuzzy or not is_translated(message):
+                continue
+            if message.pluralizable:
+                source, translation = message.id[0], message.string[0]
+            else:
+                source, translation = message.id, message.string
+            if translation:
+                self.add(to_lang, source, translation)
+                count += 1
+        return count
+
+    def match(self, to_lang, text):
+        """
+        :return: (translation, matched source string, similarity) of the
+            closest translated string with the same placeholders, or None.
+        """
+        language = self.languages.get(to_lang)
+        if language is None:
+            return None
+        key = normalize(text)
+        if not key:
+            return None
+        if language.postings is None:
+            with self._lock:
+                language.build()
+        for score, entry in language.candidates(key, trigrams(key)):
+            source = language.sources[entry]
+            if placeholders_match(source, text):
+                return language.translations[entry], source, score
+        return None
+
+    def fill(self, plan):
+        """
+        Give the plan's pending strings which have a fuzzy match that match's
+        translation, so that they aren't requested.
+
+        :return: number of strings filled in.
+        """
+        count = 0
+        for to_lang, lang_pending in plan.pending.items():
+            known = plan.results.get(to_lang, {})
+            matches = {}
+            for source in lang_pending:
+                if source in known:
+                    continue
+                match = self.match(to_lang, source)
+                if match is not None:
+                    translation, matched_source, score = match
+                    log.debug("Fuzzy match %.2f for %s: %s => %s", score, to_lang, source, matched_source)
+                    matches[source] = (translation, matched_source)
+            if matches:
+                plan.add_fuzzy_results(to_lang, matches)
+                count += len(matches)
+        log.info("Reused %s translations from fuzzy matches.", count)
+        return count
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the run journal used to checkpoint and resume runs.
+
+The result of every completed API batch is appended to the journal as soon
+as it arrives. If a run fails part way through, the next run with --resume
+replays the journal and only requests the strings that are still missing.
+"""
+
+import codecs
+import json
+import os
+import threading
+from logging import getLogger
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+
+class Journal(object):
+    """
+    An append-only file of completed batch results, one JSON object per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fileh = None
+
+    @classmethod
+    def from_config(cls, config, locale_dir):
+        """
+        :return: a Journal, or None if app.journal_file isn't configured.
+        """
+        journal_file = config.get("app", "journal_file", fallback=None)
+        if not journal_file:
+            return None
+        if locale_dir:
+            journal_file = os.path.join(locale_dir, journal_file)
+        return cls(journal_file)
+
+    def replay(self, from_lang, category):
+        """
+        Read back the results of a previous run.
+
+        :return: dict of to_lang -> dict of source string -> translated string.
+        """
+        rv = {}
+        if not os.path.exists(self.path):
+            return rv
+        count = 0
+        with codecs.open(self.path, encoding="utf-8", mode="r") as fileh:
+            for line in fileh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if the run was killed while writing it.
+                    log.warn("Ignoring damaged journal entry in: %s", self.path)
+                    continue
+                if entry["from"] != from_lang or entry["category"] != category:
+                    continue
+                rv.setdefault(entry["to"], {}).update(entry["results"])
+                count += 1
+        log.info("Replayed %s batches from journal: %s", count, self.path)
+        return rv
+
+    def start(self, resume=False):
+        """
+        Open the journal for writing; unless resuming, previous entries are discarded.
+        """
+        with self._lock:
+            self._fileh = codecs.open(self.path, encoding="utf-8", mode="a" if resume else "w")
+        return
+
+    def record(self, from_lang, to_lang, category, results):
+        """
+        Durably append the results of one batch.
+
+        :param results: dict of source string -> translated string.
+        """
+        line = json.dumps({
+            "from": from_lang,
+            "to": to_lang,
+            "category": category,
+            "results": list(results.items()),
+        }, ensure_ascii=False)
+        with self._lock:
+            self._fileh.write(line + "\n")
+            self._fileh.flush()
+            os.fsync(self._fileh.fileno())
+        return
+
+    def close(self, completed=False):
+        """
+        :param completed: True if the run finished, so the journal is no longer needed.
+        """
+        with self._lock:
+            if self._fileh is not None:
+                self._fileh.close()
+                self._fileh = None
+            if completed and os.path.exists(self.path):
+                os.unlink(self.path)
+        return
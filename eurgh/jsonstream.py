@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Streaming translation of (possibly nested) JSON string files.
+
+The source file is read incrementally and its untranslated string values
+are sent to the translator in batches as they are found. Existing
+translations and results are kept in a temporary SQLite table rather than
+in memory, and the output is written with its keys sorted, like the
+non-streaming mode, to a temporary file which replaces the target file.
+Memory use depends on the batch size, not on the size of the files.
+"""
+
+import codecs
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from json.decoder import JSONDecodeError, scanstring
+from logging import getLogger
+
+from eurgh.batching import encoded_len
+from eurgh.files import atomic_write
+from eurgh.plan import TranslationPlan
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SCALAR = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|true|false|null")
+# Characters that can make up a number or literal.
+_SCALAR_CHARS = re.compile(r"[-+.0-9a-zA-Z]*")
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+class _Tokenizer(object):
+    """
+    Splits a JSON text file into tokens, reading it in chunks.
+    Yields (kind, value) where kind is one of "{}[]:," or "string" or "scalar".
+    """
+
+    def __init__(self, fileh, chunk_size=CHUNK_SIZE):
+        self.fileh = fileh
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """
+        Read another chunk into the buffer.
+
+        :return: False if the end of the file was reached.
+        """
+        if self.eof:
+            return False
+        chunk = self.fileh.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def __iter__(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos >= len(self.buf):
+                if self._fill():
+                    continue
+                return
+            char = self.buf[self.pos]
+            if char in "{}[]:,":
+                self.pos += 1
+                yield char, None
+            elif char == '"':
+                while True:
+                    try:
+                        value, end = scanstring(self.buf, self.pos + 1)
+                        break
+                    except JSONDecodeError:
+                        # Probably cut off at the end of the buffer.
+                        if not self._fill():
+                            raise
+                self.pos = end
+                yield "string", value
+            else:
+                while _SCALAR_CHARS.match(self.buf, self.pos).end() >= len(self.buf):
+                    if not self._fill():
+                        break
+                end = _SCALAR_CHARS.match(self.buf, self.pos).end()
+                match = _SCALAR.fullmatch(self.buf, self.pos, end)
+                if not match:
+                    raise ValueError("Invalid JSON near: %r" % (self.buf[self.pos:self.pos + 20],))
+                self.pos = match.end()
+                text = match.group()
+                if text in _LITERALS:
+                    yield "scalar", _LITERALS[text]
+                else:
+                    yield "scalar", json.loads(text)
+
+
+def iter_leaves(fileh, chunk_size=CHUNK_SIZE):
+    """
+    Incrementally parse a JSON document, yielding (path, value) for every
+    scalar value and every empty object or list. path is a tuple of object
+    keys and list indexes.
+
+    >>> import io
+    >>> list(iter_leaves(io.StringIO('{"a": "x", "b": {"c": [1, true]}, "d": {}}'), chunk_size=3))
+    [(('a',), 'x'), (('b', 'c', 0), 1), (('b', 'c', 1), True), (('d',), {})]
+    """
+    path = []
+    stack = []
+    expect = "value"
+    for kind, value in _Tokenizer(fileh, chunk_size):
+        if expect in ("value", "value_or_close"):
+            if kind in ("string", "scalar"):
+                yield tuple(path), value
+                expect = "end"
+            elif kind == "{":
+                stack.append("{")
+                expect = "key_or_close"
+            elif kind == "[":
+                stack.append("[")
+                path.append(0)
+                expect = "value_or_close"
+            elif kind == "]" and expect == "value_or_close":
+                stack.pop()
+                path.pop()
+                yield tuple(path), []
+                expect = "end"
+            else:
+                raise ValueError("Unexpected %r in JSON" % (kind,))
+        elif expect in ("key", "key_or_close"):
+            if kind == "string":
+                path.append(value)
+                expect = "colon"
+            elif kind == "}" and expect == "key_or_close":
+                stack.pop()
+                yield tuple(path), {}
+                expect = "end"
+            else:
+                raise ValueError("Expected an object key in JSON, got %r" % (kind,))
+        elif expect == "colon":
+            if kind != ":":
+                raise ValueError("Expected ':' in JSON, got %r" % (kind,))
+            expect = "value"
+        else:
+            if not stack:
+                raise ValueError("Extra data after the end of JSON")
+            if kind == ",":
+                if stack[-1] == "{":
+                    path.pop()
+                    expect = "key"
+                else:
+                    path[-1] += 1
+                    expect = "value"
+            elif kind == {"{": "}", "[": "]"}[stack[-1]]:
+                stack.pop()
+                path.pop()
+            else:
+                raise ValueError("Unexpected %r in JSON" % (kind,))
+    if stack or expect != "end":
+        raise ValueError("Unexpected end of JSON")
+
+
+class JsonTreeWriter(object):
+    """
+    Writes (path, value) leaves out as an indented JSON document. Leaves must
+    arrive so that each object's and list's leaves are contiguous.
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> writer = JsonTreeWriter(out, indent=1)
+    >>> writer.write(("a",), "x")
+    >>> writer.write(("b", 0), {})
+    >>> writer.close()
+    >>> print(out.getvalue())
+    {
+     "a": "x",
+     "b": [
+      {}
+     ]
+    }
+    """
+
+    def __init__(self, fileh, indent=4):
+        self.fileh = fileh
+        self.indent = indent
+        # Keys of the open containers (below the root), their kinds and
+        # whether they have any items yet.
+        self.keys = []
+        self.kinds = []
+        self.has_items = []
+
+    def _open(self, key, kind):
+        if self.kinds:
+            self._start_item(key)
+        self.fileh.write(kind)
+        if self.kinds:
+            self.keys.append(key)
+        self.kinds.append(kind)
+        self.has_items.append(False)
+
+    def _close(self):
+        kind = self.kinds.pop()
+        had_items = self.has_items.pop()
+        if self.keys and len(self.keys) >= len(self.kinds):
+            self.keys.pop()
+        if had_items:
+            self.fileh.write("\n" + " " * (self.indent * len(self.kinds)))
+        self.fileh.write("}" if kind == "{" else "]")
+
+    def _start_item(self, key):
+        if self.has_items[-1]:
+            self.fileh.write(",")
+        self.has_items[-1] = True
+        self.fileh.write("\n" + " " * (self.indent * len(self.kinds)))
+        if self.kinds[-1] == "{":
+            self.fileh.write(json.dumps(key, ensure_ascii=False) + ": ")
+
+    def write(self, path, value):
+        if not path:
+            self.fileh.write(json.dumps(value, ensure_ascii=False))
+            return
+        if not self.kinds:
+            self._open(None, "[" if isinstance(path[0], int) else "{")
+        common = 0
+        while common < len(self.keys) and common < len(path) - 1 and self.keys[common] == path[common]:
+            common += 1
+        while len(self.keys) > common:
+            self._close()
+        for depth in range(common, len(path) - 1):
+            self._open(path[depth], "[" if isinstance(path[depth + 1], int) else "{")
+        self._start_item(path[-1])
+        self.fileh.write(json.dumps(value, ensure_ascii=False))
+
+    def close(self):
+        while self.kinds:
+            self._close()
+        return
+
+
+def sort_key(path):
+    """
+    A string which sorts paths the same as json.dump(sort_keys=True) would,
+    keeping every object's and list's leaves together.
+    """
+    return "\x00".join("%010d" % (part,) if isinstance(part, int) else part for part in path)
+
+
+def drop_filled_containers(leaves):
+    """
+    Leave out the empty objects and lists (such as a new target file's {})
+    which other leaves fill in. leaves must be in sort_key order, so that a
+    container's leaves follow it.
+
+    >>> leaves = [((), {}), (("a",), "Bonjour"), (("b",), {}), (("b", "c"), "Monde"), (("d",), [])]
+    >>> list(drop_filled_containers(leaves))
+    [(('a',), 'Bonjour'), (('b', 'c'), 'Monde'), (('d',), [])]
+    """
+    # The last empty container, held back until the next leaf shows whether it's filled.
+    empty = None
+    for path, value in leaves:
+        if empty is not None:
+            empty_path = empty[0]
+            if len(path) <= len(empty_path) or path[:len(empty_path)] != empty_path:
+                yield empty
+            empty = None
+        if value == {} or value == []:
+            empty = (path, value)
+        else:
+            yield path, value
+    if empty is not None:
+        yield empty
+    return
+
+
+class _LeafStore(object):
+    """
+    Temporary on-disk table of path -> value.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="eurgh-", suffix=".sqlite")
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("CREATE TABLE leaves (key TEXT PRIMARY KEY, path TEXT NOT NULL, value TEXT NOT NULL)")
+
+    def put_many(self, rows):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO leaves (key, path, value) VALUES (?, ?, ?)",
+            [(sort_key(path), json.dumps(path), json.dumps(value)) for path, value in rows])
+
+    def get(self, path):
+        row = self.conn.execute("SELECT value FROM leaves WHERE key = ?", (sort_key(path),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def __iter__(self):
+        for path, value in self.conn.execute("SELECT path, value FROM leaves ORDER BY key"):
+            yield tuple(json.loads(path)), json.loads(value)
+
+    def close(self):
+        self.conn.close()
+        os.unlink(self.path)
+
+
+def translate_json_file(translator, to_lang, source_file, target_file, encoding="utf-8"):
+    """
+    Translate the string values of source_file which are missing or blank in
+    target_file, and rewrite target_file with the results.
+
+    :return: True if target_file was changed.
+    """
+    store = _LeafStore()
+    try:
+        with codecs.open(target_file, encoding=encoding, mode="r") as target_fileh:
+            rows = []
+            for path, value in iter_leaves(target_fileh):
+                rows.append((path, value))
+                if len(rows) >= translator.max_batch_strings:
+                    store.put_many(rows)
+                    rows = []
+            store.put_many(rows)
+
+        was_changed = False
+        pending = []
+        pending_chars = 0
+        with codecs.open(source_file, encoding=encoding, mode="r") as source_fileh:
+            for path, value in iter_leaves(source_fileh):
+                if not path:
+                    continue
+                target_val = store.get(path)
+                if target_val:
+                    continue
+                if value is None or isinstance(value, str):
+                    source_val = value or (path[-1] if isinstance(path[-1], str) else None)
+                    if source_val:
+                        pending.append((path, source_val))
+                        pending_chars += encoded_len(source_val)
+                        if (len(pending) >= translator.max_batch_strings or
+                                pending_chars >= translator.max_batch_chars):
+                            was_changed = _translate_pending(translator, to_lang, store, pending) or was_changed
+                            pending = []
+                            pending_chars = 0
+                        continue
+                if target_val is None:
+                    store.put_many([(path, value)])
+        was_changed = _translate_pending(translator, to_lang, store, pending) or was_changed
+
+        if was_changed:
+            with atomic_write(target_file, mode="w", encoding=encoding) as outfileh:
+                writer = JsonTreeWriter(outfileh)
+                for path, value in drop_filled_containers(store):
+                    writer.write(path, value)
+                writer.close()
+            log.debug("Finished writing: %s", target_file)
+        return was_changed
+    finally:
+        store.close()
+
+
+def _translate_pending(translator, to_lang, store, pending):
+    if not pending:
+        return False
+    plan = TranslationPlan(translator.mask_placeholders)
+    plan.add(to_lang, [source_val for _path, source_val in pending])
+    plan.execute(translator)
+    rows = []
+    for path, source_val in pending:
+        xval = plan.get(to_lang, source_val)
+        if not xval:
+            log.info("Skipping %s -> %s", path, xval)
+            continue
+        log.debug("Translating %s: %s -> %s", to_lang, path, xval)
+        rows.append((path, xval))
+    store.put_many(rows)
+    log.debug("Got %s new translations for: %s", len(rows), to_lang)
+    return bool(rows)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the manifest used for incremental runs.
+
+The manifest records, for every catalog (or JSON file) Eurgh has finished,
+the file's size, mtime and digest, plus a digest of the source messages
+(from the .pot template or source JSON file) it was translated against.
+On the next run a catalog is skipped without even being parsed when
+neither it nor its source messages have changed.
+"""
+
+import codecs
+import hashlib
+import json
+import os
+import threading
+from logging import getLogger
+
+from babel.messages.pofile import read_po
+
+from eurgh.files import atomic_write
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def file_digest(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as fileh:
+        for chunk in iter(lambda: fileh.read(1 << 16), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def message_hash(*parts):
+    """
+    >>> message_hash("menu", "Open")
+    'ee33d54306a65e10'
+    """
+    return hashlib.sha1("\x00".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def messages_digest(hashes):
+    return hashlib.sha1("".join(sorted(hashes)).encode("ascii")).hexdigest()
+
+
+def pot_message_hashes(path, encoding="utf-8"):
+    """
+    :return: list of hashes of each message (context and id) in a .pot template.
+    """
+    with codecs.open(path, encoding=encoding, mode="rb") as input_file:
+        catalog = read_po(input_file)
+    rv = []
+    for message in catalog:
+        if not message.id:
+            continue
+        msg_id = message.id if isinstance(message.id, str) else "\x00".join(message.id)
+        rv.append(message_hash(message.context or "", msg_id))
+    return rv
+
+
+def json_message_hashes(path, encoding="utf-8"):
+    """
+    :return: list of hashes of each key and value in a source JSON file.
+    """
+    with codecs.open(path, encoding=encoding, mode="r") as input_file:
+        data = json.load(input_file)
+    return [message_hash(key, "%s" % (value,)) for key, value in data.items()]
+
+
+class Manifest(object):
+    """
+    Remembers the state of the catalogs and source files from the last run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # path -> {"mtime", "size", "digest", "messages": [hash, ...]}
+        self.sources = {}
+        # path -> {"mtime", "size", "digest", "source", "messages_digest"}
+        self.targets = {}
+        if os.path.exists(path):
+            with codecs.open(path, encoding="utf-8", mode="r") as fileh:
+                data = json.load(fileh)
+            if data.get("version") == MANIFEST_VERSION:
+                self.sources = data.get("sources", {})
+                self.targets = data.get("targets", {})
+            else:
+                log.warn("Ignoring manifest with unknown version: %s", path)
+        return
+
+    @classmethod
+    def from_config(cls, config, locale_dir):
+        """
+        :return: a Manifest, or None if app.manifest_file isn't configured.
+        """
+        manifest_file = config.get("app", "manifest_file", fallback=None)
+        if not manifest_file:
+            return None
+        if locale_dir:
+            manifest_file = os.path.join(locale_dir, manifest_file)
+        log.debug("Using manifest: %s", manifest_file)
+        return cls(manifest_file)
+
+    @staticmethod
+    def _file_state(path):
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+
+    def _is_unchanged(self, path, record):
+        """
+        Check a file against its record, using the mtime and size first and
+        only computing the digest when those differ.
+        """
+        if not record or not os.path.exists(path):
+            return False
+        mtime, size = self._file_state(path)
+        if (mtime, size) == (record["mtime"], record["size"]):
+            return True
+        if size != record["size"] or file_digest(path) != record["digest"]:
+            return False
+        record["mtime"] = mtime
+        return True
+
+    def _make_record(self, path):
+        mtime, size = self._file_state(path)
+        return {"mtime": mtime, "size": size, "digest": file_digest(path)}
+
+    def source_messages(self, source_path, hash_messages):
+        """
+        :param hash_messages: function(path) returning the list of message hashes.
+        :return: list of message hashes of the source file, only re-read if it changed.
+        """
+        with self._lock:
+            record = self.sources.get(source_path)
+            if self._is_unchanged(source_path, record):
+                return record["messages"]
+            record = self._make_record(source_path)
+            record["messages"] = sorted(hash_messages(source_path))
+            log.info("Read %s source messages from: %s", len(record["messages"]), source_path)
+            self.sources[source_path] = record
+            return record["messages"]
+
+    def is_current(self, target_path, source_path=None, hash_messages=None):
+        """
+        :return: True if the target, and its source messages, are unchanged
+            since the target was last recorded.
+        """
+        with self._lock:
+            record = self.targets.get(target_path)
+            if not self._is_unchanged(target_path, record):
+                return False
+        if source_path and os.path.exists(source_path):
+            digest = messages_digest(self.source_messages(source_path, hash_messages))
+            if digest != record.get("messages_digest"):
+                return False
+        return True
+
+    def record(self, target_path, source_path=None, hash_messages=None):
+        """
+        Remember the current state of a finished target file.
+        """
+        digest = None
+        if source_path and os.path.exists(source_path):
+            digest = messages_digest(self.source_messages(source_path, hash_messages))
+        with self._lock:
+            record = self._make_record(target_path)
+            record["source"] = source_path
+            record["messages_digest"] = digest
+            self.targets[target_path] = record
+        return
+
+    def save(self):
+        with self._lock:
+            data = {
+                "version": MANIFEST_VERSION,
+                "sources": self.sources,
+                "targets": self.targets,
+            }
+            with atomic_write(self.path, mode="w", encoding="utf-8") as fileh:
+                json.dump(data, fileh, sort_keys=True, indent=1)
+        log.debug("Saved manifest: %s", self.path)
+        return
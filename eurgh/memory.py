@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the persistent translation memory.
+
+The translation memory remembers every translation returned by the API,
+keyed by (from_lang, to_lang, category, source text), so that repeated runs
+and shared strings don't cost additional API calls.
+"""
+
+from logging import getLogger
+import sqlite3
+import threading
+import time
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+# Default max number of entries kept before the least recently used are evicted.
+DEFAULT_MAX_ENTRIES = 500000
+
+# Max number of bound parameters used in one SQL query.
+_QUERY_CHUNK = 500
+
+
+class TranslationMemory(object):
+    """
+    An on-disk (SQLite) cache of previous translations with size-bounded,
+    least-recently-used eviction. Safe to share between threads.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""\
+CREATE TABLE IF NOT EXISTS memory (
+    from_lang TEXT NOT NULL,
+    to_lang TEXT NOT NULL,
+    category TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (from_lang, to_lang, category, source)
+)""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS memory_used ON memory (used)")
+        # Number of entries, kept up to date by store() so that it needn't count
+        # them every time. Entries other processes add are counted on the next open.
+        self._count = self._conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+        return
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a translation memory from the [memory] section of the config.
+
+        :return: a TranslationMemory, or None if no memory file is configured.
+        """
+        path = config.get("memory", "file", fallback=None)
+        if not path:
+            return None
+        max_entries = config.getint("memory", "max_entries", fallback=DEFAULT_MAX_ENTRIES)
+        log.debug("Using translation memory: %s", path)
+        return cls(path, max_entries=max_entries)
+
+    def lookup(self, from_lang, to_lang, category, str_array):
+        """
+        Find previous translations of the given strings.
+
+        :return: dict of source string to translated string, for the strings found.
+        """
+        wanted = list(set(str_array))
+        res = {}
+        with self._lock:
+            for start in range(0, len(wanted), _QUERY_CHUNK):
+                chunk = wanted[start:start + _QUERY_CHUNK]
+                query = ("SELECT source, target FROM memory "
+                         "WHERE from_lang = ? AND to_lang = ? AND category = ? "
+                         "AND source IN (%s)" % (", ".join("?" * len(chunk)),))
+                for source, target in self._conn.execute(query, [from_lang, to_lang, category] + chunk):
+                    res[source] = target
+            if res:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE memory SET used = ? "
+                        "WHERE from_lang = ? AND to_lang = ? AND category = ? AND source = ?",
+                        [(now, from_lang, to_lang, category, source) for source in res])
+        log.debug("Translation memory found %s of %s strings for %s", len(res), len(wanted), to_lang)
+        return res
+
+    def store(self, from_lang, to_lang, category, translations):
+        """
+        Remember new translations.
+
+        :param translations: dict of source string to translated string.
+        """
+        if not translations:
+            return
+        now = time.time()
+        rows = [(target, now, from_lang, to_lang, category, source)
+                for source, target in translations.items() if target is not None]
+        with self._lock:
+            with self._conn:
+                # Existing entries are updated, so that only new ones are counted as inserted.
+                self._conn.executemany(
+                    "UPDATE memory SET target = ?, used = ? "
+                    "WHERE from_lang = ? AND to_lang = ? AND category = ? AND source = ?", rows)
+                inserted = self._conn.executemany(
+                    "INSERT OR IGNORE INTO memory (target, used, from_lang, to_lang, category, source) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", rows).rowcount
+                self._count += max(inserted, 0)
+                self._evict()
+        return
+
+    def _evict(self):
+        excess = self._count - self.max_entries
+        if excess > 0:
+            log.debug("Evicting %s old entries from translation memory", excess)
+            deleted = self._conn.execute(
+                "DELETE FROM memory WHERE rowid IN "
+                "(SELECT rowid FROM memory ORDER BY used ASC LIMIT ?)", (excess,)).rowcount
+            self._count -= deleted
+        return
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        return
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the run metrics: counters (strings and characters sent, cache hits,
+requests, retries, bytes in and out) and histograms (request latency, catalog
+parse and write times).
+
+At the end of a run they can be written out as a JSON report and as a
+Prometheus textfile, for the node exporter's textfile collector.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging import getLogger
+import json
+import os
+import threading
+import time
+
+from eurgh.files import atomic_write
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+#: Upper bounds, in seconds, of the histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+#: Descriptions of the standard metrics, used as Prometheus HELP text.
+DESCRIPTIONS = {
+    "strings_requested": "Strings asked of the translation backend, before the translation memory.",
+    "memory_hits": "Strings found in the translation memory.",
+    "journal_hits": "Strings reused from the journal of an unfinished run.",
+    "fuzzy_matches": "Strings given the translation of a similar string, flagged fuzzy.",
+    "strings_sent": "Strings sent to the translation backend.",
+    "characters_sent": "Characters sent to the translation backend.",
+    "requests": "Batches sent to the translation backend.",
+    "request_errors": "Batches which failed.",
+    "http_requests": "HTTP requests made.",
+    "retries": "HTTP requests retried after throttling or errors.",
+    "bytes_sent": "HTTP request body bytes sent.",
+    "bytes_received": "HTTP response body bytes received.",
+    "placeholder_errors": "Translations whose placeholders or markup didn't match the source.",
+    "client_requests": "Translate requests received by the daemon.",
+    "client_strings": "Strings received by the daemon, before coalescing.",
+    "catalogs_parsed": "Catalogs and JSON files read.",
+    "catalogs_written": "Catalogs and JSON files written.",
+    "catalogs_compiled": "Catalogs compiled to .mo files as they were written.",
+    "catalogs_skipped": "Unchanged catalogs and JSON files skipped in incremental mode.",
+    "request_seconds": "Latency of backend batches.",
+    "parse_seconds": "Time to read a catalog or JSON file.",
+    "write_seconds": "Time to write a catalog or JSON file.",
+    "run_seconds": "Duration of the run.",
+}
+
+
+class Histogram(object):
+    """
+    Counts observations into cumulative buckets, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        return
+
+    def cumulative(self):
+        """
+        :return: list of (upper bound, number of observations <= bound), ending with +Inf.
+        """
+        rv = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            rv.append((bound, total))
+        rv.append((float("inf"), self.count))
+        return rv
+
+    def quantile(self, q):
+        """
+        Estimate a quantile from the buckets, interpolating within the bucket.
+
+        >>> hist = Histogram((1.0, 2.0, 4.0))
+        >>> for value in (0.5, 1.5, 1.5, 3.0):
+        ...     hist.observe(value)
+        >>> hist.quantile(0.5)
+        1.5
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower = 0.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                lower = max(lower, self.min)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return OrderedDict([
+            ("count", self.count),
+            ("sum", self.sum),
+            ("min", self.min or 0.0),
+            ("max", self.max or 0.0),
+            ("p50", self.quantile(0.5)),
+            ("p90", self.quantile(0.9)),
+            ("p99", self.quantile(0.99)),
+        ])
+
+
+class Metrics(object):
+    """
+    Thread-safe counters and histograms for one run.
+
+    >>> metrics = Metrics()
+    >>> metrics.incr("requests")
+    >>> metrics.incr("strings_sent", 20)
+    >>> metrics.observe("request_seconds", 0.2)
+    >>> snapshot = metrics.snapshot()
+    >>> snapshot["counters"]["strings_sent"], snapshot["histograms"]["request_seconds"]["count"]
+    (20, 1)
+    """
+
+    def __init__(self):
+        self.counters = OrderedDict()
+        self.histograms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+        return
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+        return
+
+    @contextmanager
+    def timer(self, name, label=None):
+        """
+        Time the block into the histogram name; the label (such as a file
+        name) is only used for debug logging.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.observe(name, elapsed)
+            if label is not None:
+                log.debug("%s %s: %.3f seconds", name, label, elapsed)
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+    def snapshot(self):
+        """
+        :return: dict of the current counters and histogram summaries.
+        """
+        with self._lock:
+            return OrderedDict([
+                ("counters", OrderedDict(self.counters)),
+                ("histograms", OrderedDict(
+                    (name, histogram.summary()) for name, histogram in self.histograms.items())),
+            ])
+
+    def write_json(self, path, extra=None):
+        """
+        Write the run report: the snapshot, plus the items of extra (such as
+        the plan's report).
+        """
+        report = OrderedDict()
+        if extra:
+            report.update(extra)
+        report.update(self.snapshot())
+        with atomic_write(path, mode="w", encoding="utf-8") as fileh:
+            json.dump(report, fileh, indent=4, separators=(',', ': '))
+        log.info("Wrote run report to: %s", path)
+        return
+
+    def to_prometheus(self, prefix="eurgh", labels=None):
+        """
+        :return: the metrics in the Prometheus text exposition format.
+
+        >>> metrics = Metrics()
+        >>> metrics.incr("requests", 3)
+        >>> print(metrics.to_prometheus(labels={"domain": "messages"}).strip())
+        # HELP eurgh_requests_total Batches sent to the translation backend.
+        # TYPE eurgh_requests_total counter
+        eurgh_requests_total{domain="messages"} 3
+        """
+        label_text = _format_labels(labels or {})
+        lines = []
+        with self._lock:
+            for name, value in self.counters.items():
+                metric = "%s_%s_total" % (prefix, name)
+                lines.extend(_help_lines(metric, name, "counter"))
+                lines.append("%s%s %s" % (metric, label_text, value))
+            for name, histogram in self.histograms.items():
+                metric = "%s_%s" % (prefix, name)
+                lines.extend(_help_lines(metric, name, "histogram"))
+                for bound, count in histogram.cumulative():
+                    bucket_labels = dict(labels or {})
+                    bucket_labels["le"] = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("%s_bucket%s %s" % (metric, _format_labels(bucket_labels), count))
+                lines.append("%s_sum%s %r" % (metric, label_text, histogram.sum))
+                lines.append("%s_count%s %s" % (metric, label_text, histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="eurgh", labels=None):
+        # Written atomically, since the collector may read it at any time.
+        with atomic_write(path, mode="w", encoding="utf-8") as fileh:
+            fileh.write(self.to_prometheus(prefix, labels))
+        log.info("Wrote Prometheus metrics to: %s", path)
+        return
+
+
+def _help_lines(metric, name, kind):
+    rv = []
+    if name in DESCRIPTIONS:
+        rv.append("# HELP %s %s" % (metric, DESCRIPTIONS[name]))
+    rv.append("# TYPE %s %s" % (metric, kind))
+    return rv
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % (",".join(
+        '%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in sorted(labels.items())),)
+
+
+class MetricsReporter(object):
+    """
+    Writes the metrics out at the end of a run, to the files named by
+    metrics.report_file and metrics.prometheus_file.
+    """
+
+    def __init__(self, report_file=None, prometheus_file=None, labels=None):
+        self.report_file = report_file
+        self.prometheus_file = prometheus_file
+        self.labels = labels or {}
+
+    @classmethod
+    def from_config(cls, config, labels=None):
+        return cls(
+            report_file=config.get("metrics", "report_file", fallback=None),
+            prometheus_file=config.get("metrics", "prometheus_file", fallback=None),
+            labels=labels,
+        )
+
+    def write(self, metrics, extra=None):
+        if self.report_file:
+            metrics.write_json(os.path.expanduser(self.report_file), extra)
+        if self.prometheus_file:
+            metrics.write_prometheus(os.path.expanduser(self.prometheus_file), labels=self.labels)
+        return
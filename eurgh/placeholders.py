@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Masking of placeholders and markup.
+
+Format placeholders (%(name)s, %d, {0}), HTML tags and entities are
+replaced with short numbered tokens before strings are sent for
+translation, and put back afterwards. This makes requests smaller (markup
+is costly once XML escaped), lets strings differing only in their
+placeholders share one request, and keeps the service from mangling them.
+Translations whose placeholders don't match the source's can then be
+flagged for review.
+"""
+
+from logging import getLogger
+import re
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+#: Placeholders and markup which must come through translation unchanged.
+#: printf conversions are limited to the real types, and the space flag is
+#: left out, so that a percent sign in prose ("100% done") isn't one.
+PROTECTED = re.compile(r"%\([^)]*\)[-#0+]*\d*(?:\.\d+)?[diouxXeEfFgGcrsa]|%[-#0+]*\d*(?:\.\d+)?[diouxXeEfFgGcrsa%]|"
+                       r"\{[^{}]*\}|<[^<>]+>|&[a-zA-Z]+;|&#\d+;")
+
+# Tokens, allowing for spaces the service may have added.
+_TOKEN = re.compile(r"\{\s*(\d+)\s*\}")
+
+
+def mask(text):
+    """
+    Replace the placeholders and markup of text with numbered tokens.
+
+    >>> mask("Hello %(name)s, <b>welcome</b>!")
+    ('Hello {0}, {1}welcome{2}!', ['%(name)s', '<b>', '</b>'])
+    >>> mask("100% done")
+    ('100% done', [])
+    >>> mask("Save 50% off all items")
+    ('Save 50% off all items', [])
+
+    :return: (masked text, list of the replaced placeholders) tuple.
+    """
+    tokens = []
+
+    def replace(match):
+        tokens.append(match.group())
+        return "{%d}" % (len(tokens) - 1,)
+
+    return PROTECTED.sub(replace, text), tokens
+
+
+def unmask(text, tokens):
+    """
+    Put the placeholders back into a translated masked text. Tokens the
+    translation lost stay lost; placeholders() will tell.
+
+    >>> unmask("{1}Bienvenue{2}, { 0 } !", ['%(name)s', '<b>', '</b>'])
+    '<b>Bienvenue</b>, %(name)s !'
+    """
+    def replace(match):
+        index = int(match.group(1))
+        return tokens[index] if index < len(tokens) else match.group()
+
+    return _TOKEN.sub(replace, text)
+
+
+def placeholders(text):
+    """
+    >>> placeholders("<b>%(count)d</b> files")
+    ['%(count)d', '</b>', '<b>']
+
+    :return: sorted list of the placeholders and markup in text.
+    """
+    return sorted(PROTECTED.findall(text))
+
+
+def placeholders_match(source, translation):
+    """
+    >>> placeholders_match("%(count)d files", "%(count)d fichiers")
+    True
+    >>> placeholders_match("%(count)d files", "%(compte)d fichiers")
+    False
+    >>> placeholders_match("100% done", "100 % terminé")
+    True
+    """
+    source_placeholders = PROTECTED.findall(source)
+    translation_placeholders = PROTECTED.findall(translation)
+    if not source_placeholders and not translation_placeholders:
+        return True
+    return sorted(source_placeholders) == sorted(translation_placeholders)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the translation plan.
+
+All pending work from every catalog and language is collected into a plan
+up front. The plan requests each unique source string only once per target
+language, and the results are then handed back to every catalog that needs
+them.
+"""
+
+from collections import Counter, OrderedDict, namedtuple
+from logging import getLogger
+import threading
+
+from eurgh.batching import encoded_len, pack_batches, split_text
+from eurgh.placeholders import mask, placeholders_match, unmask
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+#: Pending work for one catalog or JSON file.
+#: sources is the list of strings it needs translated into to_lang, and
+#: finish(plan) applies the plan's results and writes out the file.
+#: flush(plan), if not None, writes out whatever results are available so far.
+#: references, if not None, holds the number of places in the source code
+#: each of the sources is used, which makes it a higher priority.
+CatalogJob = namedtuple("CatalogJob", ["to_lang", "name", "sources", "finish", "flush", "references"])
+CatalogJob.__new__.__defaults__ = (None, None)
+
+
+def count_blocks(num_strings, block_size):
+    """
+    >>> count_blocks(4001, 2000)
+    3
+    >>> count_blocks(0, 2000)
+    0
+    """
+    return (num_strings + block_size - 1) // block_size
+
+
+class TranslationPlan(object):
+    """
+    The set of unique strings to translate, per target language.
+    """
+
+    def __init__(self, mask_placeholders=False, budget=None):
+        """
+        :param mask_placeholders: request strings with their placeholders
+            and markup masked (see eurgh.placeholders).
+        :param budget: optional eurgh.budget.CharacterBudget; strings which
+            don't fit in it, lowest priority first, aren't requested.
+        """
+        self.mask_placeholders = mask_placeholders
+        self.budget = budget
+        # to_lang -> OrderedDict of source string -> number of times requested
+        self.pending = OrderedDict()
+        # to_lang -> dict of source string -> number of references in the source code
+        self.references = {}
+        # to_lang -> dict of source string -> characters, for strings left out by the budget
+        self.deferred = {}
+        # to_lang -> dict of source string -> translated string
+        self.results = {}
+        # to_lang -> dict of source string -> list of (piece, separator) for
+        # strings too long for a single request
+        self.splits = {}
+        # to_lang -> dict of source string -> (masked string, placeholders)
+        # for strings requested with their placeholders masked
+        self.masked = {}
+        # to_lang -> dict of source string -> the similar string whose
+        # translation it was given (see eurgh.fuzzy)
+        self.fuzzy = {}
+        self.jobs = []
+        # Languages whose jobs have been (or are being) finished.
+        self.finished = set()
+        self._lock = threading.Lock()
+
+    def add_job(self, job):
+        self.jobs.append(job)
+        self.add(job.to_lang, job.sources, job.references)
+        return
+
+    def add(self, to_lang, sources, references=None):
+        lang_pending = self.pending.setdefault(to_lang, OrderedDict())
+        for source in sources:
+            lang_pending[source] = lang_pending.get(source, 0) + 1
+        if references is not None:
+            lang_references = self.references.setdefault(to_lang, {})
+            for source, count in zip(sources, references):
+                lang_references[source] = lang_references.get(source, 0) + count
+        return
+
+    def by_priority(self, to_lang):
+        """
+        :return: the language's pending strings, the most referenced first.
+        """
+        lang_pending = self.pending[to_lang]
+        lang_references = self.references.get(to_lang)
+        if not lang_references:
+            return list(lang_pending)
+        # Sorting is stable, so equally referenced strings keep their order.
+        return sorted(lang_pending, key=lambda source: -lang_references.get(source, 0))
+
+    def languages(self):
+        """
+        :return: the languages, in the budget's priority order if there is one.
+        """
+        if self.budget is None:
+            return list(self.pending)
+        return self.budget.order_languages(self.pending)
+
+    def unresolved(self, to_lang):
+        """
+        :return: list of the language's pending strings without results,
+            and the masked forms they would be requested as, if any.
+        """
+        known = self.results.get(to_lang, {})
+        rv = []
+        for source in self.pending[to_lang]:
+            if source in known:
+                continue
+            rv.append(source)
+            if self.mask_placeholders:
+                masked, tokens = mask(source)
+                if tokens:
+                    rv.append(masked)
+        return rv
+
+    def add_results(self, to_lang, results):
+        """
+        Add translations obtained elsewhere (such as from a journal or the
+        translation memory), which will not be requested again.
+        """
+        with self._lock:
+            self.results.setdefault(to_lang, {}).update(results)
+        return
+
+    def add_fuzzy_results(self, to_lang, matches):
+        """
+        Add translations reused from similar strings, which need review.
+
+        :param matches: dict of source string -> (translation, matched source string).
+        """
+        with self._lock:
+            lang_results = self.results.setdefault(to_lang, {})
+            lang_fuzzy = self.fuzzy.setdefault(to_lang, {})
+            for source, (translation, matched_source) in matches.items():
+                lang_results[source] = translation
+                lang_fuzzy[source] = matched_source
+        return
+
+    def batches(self, max_strings, max_chars):
+        """
+        Pack the pending strings without results into requests, masking
+        their placeholders if configured. Strings longer than max_chars are
+        split into pieces which are translated separately. With a budget,
+        languages and strings are taken in priority order, and those which
+        don't fit are deferred instead.
+
+        :return: list of (to_lang, list of unique strings to request) tuples.
+        """
+        rv = []
+        spending = self.budget.start() if self.budget is not None else None
+        self.deferred = {}
+        for to_lang in self.languages():
+            known = self.results.get(to_lang, {})
+            sources = OrderedDict()
+            # Requests already paid for; different sources can mask to the same one.
+            charged = set()
+            for source in (self.by_priority(to_lang) if spending is not None else self.pending[to_lang]):
+                if source in known:
+                    continue
+                request = source
+                if self.mask_placeholders:
+                    masked, tokens = mask(source)
+                    if tokens:
+                        self.masked.setdefault(to_lang, {})[source] = (masked, tokens)
+                        request = masked
+                        if request in known:
+                            continue
+                if spending is not None and request not in charged:
+                    if not spending.spend(to_lang, encoded_len(request)):
+                        self.deferred.setdefault(to_lang, {})[source] = encoded_len(request)
+                        continue
+                    charged.add(request)
+                if encoded_len(request) > max_chars:
+                    pieces = split_text(request, max_chars)
+                    self.splits.setdefault(to_lang, {})[request] = pieces
+                    for piece, _separator in pieces:
+                        if piece not in known:
+                            sources[piece] = True
+                else:
+                    sources[request] = True
+            for batch in pack_batches(list(sources.keys()), max_strings, max_chars):
+                rv.append((to_lang, batch))
+        return rv
+
+    def deferred_count(self, job):
+        """
+        :return: number of the job's strings which the budget left out of
+            the last batches() and so weren't requested.
+        """
+        lang_deferred = self.deferred.get(job.to_lang)
+        if not lang_deferred:
+            return 0
+        return sum(1 for source in set(job.sources) if source in lang_deferred)
+
+    def execute(self, translator, run_tasks=None, journal=None, checkpoint=None, language_done=None):
+        """
+        Translate every pending string.
+
+        :param run_tasks: optional function(func, items) used to run the
+            batches, such as EurghApp.run_tasks for concurrent requests.
+        :param journal: optional Journal which records each batch's results
+            as soon as they arrive.
+        :param checkpoint: optional function(plan, completed_batches) called
+            after each batch completes.
+        :param language_done: optional function(plan, to_lang) called as soon
+            as the last batch of a language completes, so its jobs can be
+            finished while other languages are still being translated.
+        """
+        if run_tasks is None:
+            def run_tasks(func, items):
+                return [func(item) for item in items]
+
+        batches = self.batches(translator.max_batch_strings, translator.max_batch_chars)
+        log.debug("Executing plan with %s requests", len(batches))
+        with self._lock:
+            # Results from elsewhere (such as a journal) may complete masked or split strings.
+            for to_lang in self.results:
+                self._resolve(to_lang)
+        completed = [0]
+        remaining = Counter(to_lang for to_lang, _sources in batches)
+
+        def run_batch(batch):
+            to_lang, sources = batch
+            result = translator.translate_strings(sources, to_lang=to_lang)
+            if journal is not None:
+                journal.record(translator.from_lang, to_lang, translator.result_category, result)
+            with self._lock:
+                self.results.setdefault(to_lang, {}).update(result)
+                self._resolve(to_lang)
+                completed[0] += 1
+                count = completed[0]
+                remaining[to_lang] -= 1
+                lang_done = remaining[to_lang] == 0
+            if checkpoint is not None:
+                checkpoint(self, count)
+            if lang_done and language_done is not None:
+                language_done(self, to_lang)
+
+        run_tasks(run_batch, batches)
+        return
+
+    def _resolve(self, to_lang):
+        """
+        Put back together any split strings whose pieces have all been
+        translated, then put back the placeholders of masked strings.
+        """
+        lang_results = self.results[to_lang]
+        for source, pieces in self.splits.get(to_lang, {}).items():
+            if source in lang_results:
+                continue
+            if all(piece in lang_results for piece, _separator in pieces):
+                lang_results[source] = "".join(
+                    "%s%s" % (lang_results[piece], separator) for piece, separator in pieces)
+        for source, (masked, tokens) in self.masked.get(to_lang, {}).items():
+            if source not in lang_results and masked in lang_results:
+                lang_results[source] = unmask(lang_results[masked], tokens)
+        return
+
+    def get(self, to_lang, source, default=None):
+        return self.results.get(to_lang, {}).get(source, default)
+
+    def placeholders_ok(self, to_lang, source):
+        """
+        :return: False if the translation of source lost, gained or changed
+            any placeholders or markup.
+        """
+        translation = self.get(to_lang, source)
+        return translation is None or placeholders_match(source, translation)
+
+    def flush(self):
+        """
+        Hand the results so far back to every unfinished job which supports
+        partial results.
+        """
+        for job in self.jobs:
+            if job.flush is not None and job.to_lang not in self.finished:
+                job.flush(self)
+        return
+
+    def _claim_jobs(self, to_lang=None):
+        """
+        Mark the language (or every language) finished.
+
+        :return: list of the jobs which weren't already finished.
+        """
+        with self._lock:
+            langs = set(job.to_lang for job in self.jobs) if to_lang is None else {to_lang}
+            langs -= self.finished
+            self.finished.update(langs)
+        return [job for job in self.jobs if job.to_lang in langs]
+
+    def finish_language(self, to_lang):
+        """
+        Hand the results back to the jobs of one language.
+        """
+        for job in self._claim_jobs(to_lang):
+            job.finish(self)
+        return
+
+    def finish(self, run_tasks=None):
+        """
+        Hand the results back to every job not finished yet.
+        """
+        jobs = self._claim_jobs()
+        if run_tasks is None:
+            for job in jobs:
+                job.finish(self)
+        else:
+            run_tasks(lambda job: job.finish(self), jobs)
+        return
+
+    def report(self, max_strings, max_chars):
+        """
+        Describe how much work the plan saves by removing duplicates.
+
+        :return: dict of statistics.
+        """
+        total_strings = total_chars = unique_strings = unique_chars = 0
+        language_chars = OrderedDict()
+        for to_lang in self.languages():
+            lang_chars = 0
+            for source, count in self.pending[to_lang].items():
+                unique_strings += 1
+                lang_chars += len(source)
+                total_strings += count
+                total_chars += len(source) * count
+            language_chars[to_lang] = lang_chars
+            unique_chars += lang_chars
+        naive_requests = sum(count_blocks(len(job.sources), max_strings) for job in self.jobs)
+        planned_requests = len(self.batches(max_strings, max_chars))
+        masked_chars_saved = 0
+        for lang_masked in self.masked.values():
+            for source, (masked, _tokens) in lang_masked.items():
+                masked_chars_saved += len(source) - len(masked)
+        return OrderedDict([
+            ("catalogs", len(self.jobs)),
+            ("languages", len(self.pending)),
+            ("strings", total_strings),
+            ("unique_strings", unique_strings),
+            ("characters", total_chars),
+            ("unique_characters", unique_chars),
+            ("characters_saved", total_chars - unique_chars),
+            ("masked_characters_saved", masked_chars_saved),
+            ("fuzzy_matches", sum(len(lang_fuzzy) for lang_fuzzy in self.fuzzy.values())),
+            ("requests", naive_requests),
+            ("planned_requests", planned_requests),
+            ("requests_saved", naive_requests - planned_requests),
+            ("language_characters", language_chars),
+            ("deferred_strings", sum(len(lang_deferred) for lang_deferred in self.deferred.values())),
+            ("deferred_characters", sum(sum(lang_deferred.values()) for lang_deferred in self.deferred.values())),
+        ])
+
+    def catalog_characters(self):
+        """
+        :return: list of (job, characters of its unique strings) tuples, an
+            estimate of what each catalog costs on its own.
+        """
+        return [(job, sum(len(source) for source in set(job.sources))) for job in self.jobs]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Plural forms of message catalogs.
+
+A pluralized message has a singular and a plural source string, but the
+target language may have any number of plural forms. Both source strings
+are translated, and each of the language's forms is filled in from one of
+them, according to the catalog's plural_forms expression.
+"""
+
+from logging import getLogger
+import gettext
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+SINGULAR = 0
+PLURAL = 1
+
+
+def plural_sources(num_plurals, plural_expr):
+    """
+    Decide which source string each plural form of a language is translated
+    from: the form used for n = 1 takes the singular, and every other form
+    the plural. A language with a single form takes the plural.
+
+    >>> plural_sources(2, "(n > 1)")                          # French
+    [0, 1]
+    >>> plural_sources(3, "(n%10==1 && n%100!=11 ? 0 : n%10>=2 && n%10<=4 && (n%100<10 || n%100>=20) ? 1 : 2)")
+    [0, 1, 1]
+    >>> plural_sources(1, "0")                                # Japanese
+    [1]
+
+    :return: list of SINGULAR or PLURAL, one per plural form.
+    """
+    if num_plurals <= 1:
+        return [PLURAL]
+    try:
+        singular_form = gettext.c2py(plural_expr)(1)
+    except (ValueError, SyntaxError) as e:
+        log.warn("Can't evaluate plural forms expression %r (%s), assuming the first form is singular",
+                 plural_expr, e)
+        singular_form = 0
+    return [SINGULAR if form == singular_form else PLURAL for form in range(num_plurals)]
+
+
+def message_ids(message):
+    """
+    :return: tuple of the source strings of a babel Message: the id, or the
+        singular and plural ids.
+    """
+    if message.pluralizable:
+        return tuple(message.id)
+    return (message.id,)
+
+
+def is_translated(message):
+    """
+    :return: True if the message has any translation.
+    """
+    if message.pluralizable:
+        return any(message.string or ())
+    return bool(message.string)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Client side rate limiting and retry backoff for API calls.
+"""
+
+from email.utils import parsedate_tz, mktime_tz
+from logging import getLogger
+import random
+import threading
+import time
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+# HTTP status codes worth retrying: throttling and temporary server errors.
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+
+
+class TokenBucket(object):
+    """
+    Allows on average `rate` units per second, with bursts of up to `capacity`.
+    A rate of 0 means unlimited.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """
+        Take amount units from the bucket, going into debt if needed.
+
+        :return: number of seconds the caller should wait before proceeding.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, amount=1):
+        """
+        Block until amount units are available.
+        """
+        delay = self.reserve(amount)
+        if delay > 0:
+            log.debug("Rate limit: waiting %.2f seconds", delay)
+            time.sleep(delay)
+        return
+
+
+class RateLimiter(object):
+    """
+    Limits both the requests per second and the characters per second.
+    """
+
+    def __init__(self, requests_per_second=0, characters_per_second=0):
+        self.requests = TokenBucket(requests_per_second)
+        self.characters = TokenBucket(characters_per_second)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            requests_per_second=config.getfloat("translate", "requests_per_second", fallback=0),
+            characters_per_second=config.getfloat("translate", "characters_per_second", fallback=0),
+        )
+
+    def acquire(self, characters=0):
+        delay = max(self.requests.reserve(1), self.characters.reserve(characters))
+        if delay > 0:
+            log.debug("Rate limit: waiting %.2f seconds", delay)
+            time.sleep(delay)
+        return
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date.
+
+    >>> parse_retry_after("120")
+    120.0
+    >>> parse_retry_after(None) is None
+    True
+
+    :return: number of seconds to wait, or None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+
+def retry_delay(attempt, backoff=1.0, max_delay=60.0, retry_after=None):
+    """
+    The delay before retry number `attempt` (starting at 0): exponential
+    backoff with full jitter, or the server's Retry-After if it is longer.
+
+    >>> 0 <= retry_delay(3, backoff=1.0) <= 8
+    True
+    >>> retry_delay(0, retry_after=5.0) >= 5.0
+    True
+    """
+    delay = random.uniform(0, min(max_delay, backoff * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
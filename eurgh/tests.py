@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+The test suite: the doctests of every eurgh module.
+
+Run with ``python -m unittest eurgh.tests`` (or ``python setup.py test``).
+"""
+
+import doctest
+import importlib
+import pkgutil
+
+import eurgh
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+# Modules not to import: __main__ runs the command line, and this one has no doctests.
+_SKIP = ("__main__", "tests")
+
+
+def load_tests(loader, tests, pattern):
+    tests.addTests(doctest.DocTestSuite(eurgh))
+    for _finder, name, _is_package in pkgutil.iter_modules(eurgh.__path__):
+        if name in _SKIP:
+            continue
+        module = importlib.import_module("eurgh.%s" % (name,))
+        try:
+            tests.addTests(doctest.DocTestSuite(module))
+        except ValueError:
+            # Older Pythons refuse modules without any doctests.
+            pass
+    return tests
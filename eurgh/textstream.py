@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Translates plain text streams, such as stdin or large text files, line by
+line or paragraph by paragraph.
+
+The text is read incrementally and packed into full batches. Several
+batches are in flight at once, and the output is written in order as soon
+as each batch completes, so memory stays bounded however long the input is.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+import re
+
+from eurgh.batching import encoded_len
+from eurgh.plan import TranslationPlan
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+# Default number of batches in flight at once.
+DEFAULT_PIPELINE = 4
+
+_EDGES = re.compile(r"^(\s*)(.*?)(\s*)$", re.DOTALL)
+
+
+def iter_units(fileh, paragraphs=False):
+    """
+    Split text into the units which are translated: lines, or paragraphs
+    separated by blank lines.
+
+    >>> import io
+    >>> list(iter_units(io.StringIO(u"One\\nTwo\\n\\n\\nThree")))
+    [('One', '\\n'), ('Two', '\\n'), ('', '\\n'), ('', '\\n'), ('Three', '')]
+    >>> list(iter_units(io.StringIO(u"One\\nTwo\\n\\n\\nThree"), paragraphs=True))
+    [('One\\nTwo', '\\n\\n\\n'), ('Three', '')]
+
+    :return: iterator of (text, separator) pairs, which put back together
+        are the original text.
+    """
+    if not paragraphs:
+        for line in fileh:
+            text = line.rstrip("\r\n")
+            yield text, line[len(text):]
+        return
+
+    lines = []
+    separator = ""
+    for line in fileh:
+        if not line.strip():
+            separator += line
+            continue
+        if separator:
+            yield _paragraph(lines, separator)
+            lines = []
+            separator = ""
+        lines.append(line)
+    if lines or separator:
+        yield _paragraph(lines, separator)
+
+
+def _paragraph(lines, separator):
+    # A paragraph keeps its internal line breaks; its final one goes with the separator.
+    text = "".join(lines)
+    body = text.rstrip("\r\n")
+    return body, text[len(body):] + separator
+
+
+def split_edges(text):
+    """
+    >>> split_edges("  Hello there \\n")
+    ('  ', 'Hello there', ' \\n')
+
+    :return: (leading whitespace, text, trailing whitespace) tuple.
+    """
+    return _EDGES.match(text).groups()
+
+
+def translate_chunk(translator, to_lang, units):
+    """
+    Translate one batch of units.
+
+    :return: the translated text of the units, put back together.
+    """
+    sources = []
+    for text, _separator in units:
+        core = split_edges(text)[1]
+        if core:
+            sources.append(core)
+    plan = TranslationPlan(translator.mask_placeholders)
+    plan.add(to_lang, sources)
+    plan.execute(translator)
+
+    parts = []
+    for text, separator in units:
+        lead, core, trail = split_edges(text)
+        if core:
+            core = plan.get(to_lang, core) or core
+        parts.append(lead + core + trail + separator)
+    return "".join(parts)
+
+
+def translate_stream(translator, infile, outfile, to_lang=None, paragraphs=False, pipeline=DEFAULT_PIPELINE):
+    """
+    Translate the text of infile into outfile.
+
+    :param pipeline: max number of batches in flight at once.
+    :return: number of units (lines or paragraphs) read.
+    """
+    if to_lang is None:
+        to_lang = translator.to_langs[0]
+    units = iter_units(infile, paragraphs)
+
+    pending = deque()
+    count = 0
+
+    def write_done(block):
+        # Write out completed batches in order; with block, wait for the oldest.
+        while pending and (block or pending[0].done()):
+            outfile.write(pending.popleft().result())
+            outfile.flush()
+            block = False
+
+    with ThreadPoolExecutor(max_workers=max(1, pipeline)) as executor:
+        chunk = []
+        chunk_chars = 0
+        for unit in units:
+            count += 1
+            chunk.append(unit)
+            chunk_chars += encoded_len(unit[0])
+            if len(chunk) >= translator.max_batch_strings or chunk_chars >= translator.max_batch_chars:
+                pending.append(executor.submit(translate_chunk, translator, to_lang, chunk))
+                chunk = []
+                chunk_chars = 0
+                write_done(len(pending) >= pipeline)
+        if chunk:
+            pending.append(executor.submit(translate_chunk, translator, to_lang, chunk))
+        while pending:
+            write_done(True)
+    log.debug("Translated %s %s", count, "paragraphs" if paragraphs else "lines")
+    return count
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the access token manager.
+
+The token is shared by every thread, fetched by only one of them at a time,
+and refreshed in the background some time before it expires, so requests
+never wait for (or fail on) an expiring token. It can also be kept in a
+cache file shared by several eurgh processes, which then need only one
+token between them.
+"""
+
+from logging import getLogger
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from eurgh.files import atomic_write
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+# Default number of seconds before expiry to refresh the token.
+DEFAULT_REFRESH_MARGIN = 60
+
+
+class TokenManager(object):
+    """
+    Hands out a valid access token to any number of threads.
+
+    >>> fetches = []
+    >>> def fetch():
+    ...     fetches.append(1)
+    ...     return {"access_token": "abc", "expires_in": "600"}
+    >>> tokens = TokenManager(fetch)
+    >>> tokens.get()["access_token"], tokens.get()["access_token"], len(fetches)
+    ('abc', 'abc', 1)
+    """
+
+    def __init__(self, fetch, refresh_margin=DEFAULT_REFRESH_MARGIN, cache_file=None, cache_key=None):
+        """
+        :param fetch: function which requests a new token, returning a dict
+            with access_token and expires_in (seconds).
+        :param cache_file: optional file to share the token with other processes.
+        :param cache_key: identifies the account, so that a cache file is
+            never used for the wrong one.
+        """
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.cache_file = cache_file
+        self.cache_key = cache_key
+        self._token = None
+        self._expires = 0.0
+        # The last token the API rejected, which a cache file may still hold.
+        self._rejected = None
+        # Guards the token; never held while fetching one.
+        self._lock = threading.Lock()
+        # Held while fetching a token (and reading or writing the cache file),
+        # so that only one thread does at a time.
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    @classmethod
+    def from_config(cls, config, fetch, cache_key=None):
+        cache_file = config.get("translate", "token_cache_file", fallback=None)
+        return cls(
+            fetch,
+            refresh_margin=config.getfloat("translate", "token_refresh_margin", fallback=DEFAULT_REFRESH_MARGIN),
+            cache_file=os.path.expanduser(cache_file) if cache_file else None,
+            cache_key=cache_key,
+        )
+
+    @staticmethod
+    def make_cache_key(*parts):
+        """
+        :return: a digest of parts (such as the client ID and auth URL), which
+            doesn't reveal them.
+        """
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def is_valid(self, margin=0.0):
+        return self._token is not None and time.time() < self._expires - margin
+
+    def get(self):
+        """
+        :return: the token dict. Blocks only if there's no usable token at all.
+        """
+        start_refresh = False
+        with self._lock:
+            token = self._token
+            valid = self.is_valid()
+            if valid and not self.is_valid(self.refresh_margin) and not self._refreshing:
+                self._refreshing = start_refresh = True
+        if start_refresh:
+            thread = threading.Thread(target=self._background_refresh, name="eurgh-token-refresh")
+            thread.daemon = True
+            thread.start()
+        if valid:
+            return token
+        with self._refresh_lock:
+            # Another thread may have fetched one while this one waited.
+            if not self.is_valid():
+                self._refresh()
+            with self._lock:
+                return self._token
+
+    def invalidate(self):
+        """
+        Forget the token, such as when the API rejects it. The cache file
+        isn't trusted with it either, so the next get() fetches a new one.
+
+        >>> import tempfile
+        >>> tokens = []
+        >>> def fetch():
+        ...     tokens.append("t%s" % (len(tokens),))
+        ...     return {"access_token": tokens[-1], "expires_in": "600"}
+        >>> cache_file = os.path.join(tempfile.mkdtemp(), "token.json")
+        >>> manager = TokenManager(fetch, cache_file=cache_file)
+        >>> manager.get()["access_token"]
+        't0'
+        >>> manager.invalidate()
+        >>> manager.get()["access_token"]
+        't1'
+        """
+        with self._lock:
+            if self._token is not None:
+                self._rejected = self._token
+            self._token = None
+            self._expires = 0.0
+        return
+
+    def _background_refresh(self):
+        try:
+            with self._refresh_lock:
+                if not self.is_valid(self.refresh_margin):
+                    self._refresh()
+        except Exception as e:
+            # The current token is still good; the next caller will try again.
+            log.warn("Background access token refresh failed: %s", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+        return
+
+    def _refresh(self):
+        # Called with self._refresh_lock held, and not self._lock.
+        if self.cache_file is None:
+            self._set(self.fetch())
+            return
+        with self._cache_lock():
+            # Another process may have just refreshed it.
+            if self._load_cache():
+                return
+            token = self.fetch()
+            expires = self._set(token)
+            self._save_cache(token, expires)
+        return
+
+    def _set(self, token, expires=None):
+        """
+        :return: when the token expires.
+        """
+        if expires is None:
+            expires = time.time() + float(token["expires_in"])
+        with self._lock:
+            self._token = token
+            self._expires = expires
+        log.debug("Got access token, expires in %.0f seconds", expires - time.time())
+        return expires
+
+    def _load_cache(self):
+        """
+        :return: True if the cache file has a token for this account which
+            isn't due for refresh and hasn't been rejected.
+        """
+        try:
+            with open(self.cache_file, "r") as fileh:
+                cached = json.load(fileh)
+        except (IOError, OSError, ValueError):
+            return False
+        if cached.get("key") != self.cache_key or time.time() >= cached.get("expires", 0) - self.refresh_margin:
+            return False
+        if cached.get("token") == self._rejected:
+            log.debug("Ignoring the rejected access token in: %s", self.cache_file)
+            return False
+        self._set(cached["token"], cached["expires"])
+        log.debug("Using cached access token from: %s", self.cache_file)
+        return True
+
+    def _save_cache(self, token, expires):
+        try:
+            # Only readable by this user, since the token grants access to the account.
+            with atomic_write(self.cache_file, mode="w", encoding="utf-8", file_mode=0o600) as fileh:
+                json.dump({"key": self.cache_key, "expires": expires, "token": token}, fileh)
+        except (IOError, OSError) as e:
+            log.warn("Can't write the access token cache %s: %s", self.cache_file, e)
+        return
+
+    def _cache_lock(self):
+        return _FileLock(self.cache_file + ".lock")
+
+
+class _FileLock(object):
+    """
+    An exclusive lock between processes, where supported (fcntl); otherwise
+    processes may occasionally both fetch a token, which is harmless.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fileh = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            try:
+                self._fileh = open(self.path, "a")
+                fcntl.flock(self._fileh.fileno(), fcntl.LOCK_EX)
+            except (IOError, OSError) as e:
+                log.debug("Can't lock %s: %s", self.path, e)
+                self._close()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._close()
+        return False
+
+    def _close(self):
+        if self._fileh is not None:
+            self._fileh.close()
+            self._fileh = None
+        return
@@ -6,10 +6,11 @@
 Contains the Microsoft Translation API client.
 """
 
-from configparser import ConfigParser
 from json import loads
 
 from logging import getLogger
+import http.client
+import threading
 import time
 import re
 
@@ -18,10 +19,13 @@ import re
 from six.moves.urllib.error import HTTPError
 # noinspection PyUnresolvedReferences
 from six.moves.urllib.parse import urlencode
-# noinspection PyUnresolvedReferences
-from six.moves.urllib.request import Request, urlopen
 from xml.etree import ElementTree as ET
+from eurgh.backend import CAP_CATEGORY, CAP_NETWORK, TranslationBackend
 from eurgh.languages import LANGUAGES
+from eurgh.ratelimit import RETRY_STATUS, RateLimiter, parse_retry_after, retry_delay
+from eurgh.tokens import TokenManager
+from eurgh.transport import ConnectionPool
+from eurgh.xmlcodec import decode_array_response, encode_array_request
 
 __author__ = 'Preston Landers (planders@gmail.com)'
 __copyright__ = 'Copyright (c) 2014 Preston Landers'
@@ -34,7 +38,10 @@ def strip_tag(atag):
     return re.sub(r"{.*?}", "", atag)
 
 
-class EurghTranslator(object):
+class EurghTranslator(TranslationBackend):
+    """
+    The Microsoft Translator backend.
+    """
     BASE_API = "http://api.microsofttranslator.com/v2/Http.svc/"
 
     AUTH_URL = "https://datamarket.accesscontrol.windows.net/v2/OAuth2-13"
@@ -42,14 +49,13 @@ class EurghTranslator(object):
     # Max size of string array for TranslateArray
     MAX_API_ARRAY = 2000
 
-    def __init__(self, config_file):
-        self.config = config = ConfigParser()
-        config.read(config_file)
-        self._access_token = None
-        self._access_token_expires = time.time()
+    name = "microsoft"
 
-        self.from_lang = config.get("translate", "from_lang")
-        self.to_langs = config.get("translate", "to_lang").split(" ")
+    capabilities = frozenset([CAP_NETWORK, CAP_CATEGORY])
+
+    def __init__(self, config_file):
+        super(EurghTranslator, self).__init__(config_file)
+        config = self.config
 
         for lang in self.to_langs:
             if lang not in LANGUAGES:
@@ -58,22 +64,33 @@ class EurghTranslator(object):
         self.client_id = config.get("secrets", "client_id")
         self.client_secret = config.get("secrets", "client_secret")
 
-        self.api_category = config.get("translate", "category", fallback="general")
+        # The endpoints can be pointed elsewhere, such as a local stand-in for testing.
+        self.BASE_API = config.get("translate", "api_url", fallback=self.BASE_API)
+        self.AUTH_URL = config.get("translate", "auth_url", fallback=self.AUTH_URL)
+
+        # Shared by all threads, refreshed ahead of expiry, and optionally cached on disk.
+        self.tokens = TokenManager.from_config(
+            config, self.get_access_token, TokenManager.make_cache_key(self.client_id, self.AUTH_URL))
+
+        # Limits the number of API requests in progress at once across all threads.
+        self.max_in_flight = config.getint("translate", "max_in_flight", fallback=4)
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+
+        # Persistent connections shared by all API calls.
+        self.transport = ConnectionPool.from_config(config, self.metrics)
+
+        self.rate_limiter = RateLimiter.from_config(config)
+        self.max_retries = config.getint("translate", "max_retries", fallback=5)
+        self.retry_backoff = config.getfloat("translate", "retry_backoff", fallback=1.0)
+        self.retry_max_delay = config.getfloat("translate", "retry_max_delay", fallback=60.0)
         return
 
     @property
     def access_token(self):
-        if self._access_token and self.is_access_token_ok():
-            return self._access_token
-        self._access_token = self.get_access_token()
-        expires_in = int(self._access_token['expires_in'])
-        self._access_token_expires = time.time() + expires_in
-        return self._access_token
+        return self.tokens.get()
 
     def is_access_token_ok(self):
-        if time.time() >= self._access_token_expires:
-            return False
-        return True
+        return self.tokens.is_valid()
 
     def get_access_token(self):
         data = dict(
@@ -83,10 +100,10 @@ class EurghTranslator(object):
             grant_type="client_credentials",
         )
         data_bytes = urlencode(data).encode("utf-8")
-        request = Request(self.AUTH_URL, data_bytes, method="POST")
-        request.add_header("Content-Type", "application/x-www-form-urlencoded;charset=utf-8")
-        response = urlopen(request, data_bytes)
-        result = response.read().decode("utf-8")
+        response = self.transport.request(
+            "POST", self.AUTH_URL, data_bytes,
+            {"Content-Type": "application/x-www-form-urlencoded;charset=utf-8"})
+        result = response.text()
         result_dict = loads(result)
         return result_dict
 
@@ -106,51 +123,37 @@ class EurghTranslator(object):
             ("contentType", "text/plain"),
             ("category", self.api_category),
         ])
-        request = Request(url + params)
-        result = self.run_request(request)
+        result = self.run_request("GET", url + params, characters=len(tr_string))
         return self.deserialize(result)
 
-    def translate_strings(self, str_array, from_lang=None, to_lang=None):
-        if len(str_array) > self.MAX_API_ARRAY:
-            raise ValueError(
-                "List is too big to translate, %s is greater than %s" % (len(str_array), self.MAX_API_ARRAY))
-        if from_lang is None:
-            from_lang = self.from_lang
-        if to_lang is None:
-            to_lang = self.to_langs[0]
+    def translate_batch(self, str_array, from_lang, to_lang):
+        """
+        Call the TranslateArray API for the given strings.
+
+        :return: dict of source string to translated string.
+        """
         url = self.BASE_API + "TranslateArray?"
-        # Must be in this order!
-        data = [("from", from_lang)]
-        data.extend([("texts", thing) for thing in str_array])
-        data.extend([("to", to_lang)])
-
-        strings_enc = "\n".join([self.serialize(thing) for thing in str_array])
-        category = self.api_category
-        content_type = "text/plain"
-
-        data = """\
-<TranslateArrayRequest>
-  <AppId />
-  <From>%(from_lang)s</From>
-  <Options>
-    <Category xmlns="http://schemas.datacontract.org/2004/07/Microsoft.MT.Web.Service.V2" >%(category)s</Category>
-    <ContentType xmlns="http://schemas.datacontract.org/2004/07/Microsoft.MT.Web.Service.V2">%(content_type)s</ContentType>
-    <ReservedFlags xmlns="http://schemas.datacontract.org/2004/07/Microsoft.MT.Web.Service.V2" />
-    <State xmlns="http://schemas.datacontract.org/2004/07/Microsoft.MT.Web.Service.V2" />
-    <Uri xmlns="http://schemas.datacontract.org/2004/07/Microsoft.MT.Web.Service.V2" />
-    <User xmlns="http://schemas.datacontract.org/2004/07/Microsoft.MT.Web.Service.V2" />
-  </Options>
-  <Texts>
-    %(strings_enc)s
-  </Texts>
-  <To>%(to_lang)s</To>
-</TranslateArrayRequest>""" % locals()
-
-        data_bytes = bytes(data.encode("utf-8"))
-        request = Request(url, data_bytes, method="POST")
-        request.add_header("Content-Type", "text/xml")
-        result = self.run_request(request)
-        return self.simplify_array_result(str_array, self.deserialize_array(result))
+        data_bytes = self.build_array_request(str_array, from_lang, to_lang)
+        result = self.run_request("POST", url, data_bytes, {"Content-Type": "text/xml"},
+                                  characters=sum(len(thing) for thing in str_array), raw=True)
+        return self.align_array_result(str_array, decode_array_response(result))
+
+    def build_array_request(self, str_array, from_lang, to_lang):
+        """
+        :return: the TranslateArray request body, as bytes.
+        """
+        return encode_array_request(str_array, from_lang, to_lang, self.api_category, "text/plain")
+
+    @staticmethod
+    def align_array_result(orig_array, translations):
+        """
+        :param translations: list of translated strings, in the order of orig_array.
+        :return: dict of source string to translated string.
+        """
+        if len(translations) != len(orig_array):
+            raise ValueError("Expected %s translations from TranslateArray, got %s" % (
+                len(orig_array), len(translations)))
+        return dict(zip(orig_array, translations))
 
     @staticmethod
     def simplify_array_result(orig_array, result_list):
@@ -168,17 +171,50 @@ class EurghTranslator(object):
         thing = thing.replace(">", "&gt;")
         return '<string xmlns="http://schemas.microsoft.com/2003/10/Serialization/Arrays">%s</string>' % (thing,)
 
-    def run_request(self, request):
-        request.add_header("Authorization", "Bearer %s" % (self.access_token['access_token'],))
-        try:
-            response = urlopen(request)
-        except HTTPError as e:
-            print("ERROR")
-            print(e)
-            # return 1
-            raise e
-        result = response.read().decode("utf-8")
-        return result
+    def run_request(self, method, url, data=None, headers=None, characters=0, raw=False):
+        """
+        Make an authorized API call, within the configured rate limits.
+        Throttling, server and network errors are retried with exponential
+        backoff, honoring any Retry-After header.
+
+        :param characters: number of characters being translated, for the rate limiter.
+        :param raw: return the undecoded response body.
+        :return: the response text (or bytes, if raw).
+        """
+        attempt = 0
+        reauthorized = False
+        while True:
+            self.rate_limiter.acquire(characters)
+            headers = dict(headers or {})
+            headers["Authorization"] = "Bearer %s" % (self.access_token['access_token'],)
+            with self._in_flight:
+                try:
+                    response = self.transport.request(method, url, data, headers)
+                    return response.body if raw else response.text()
+                except HTTPError as e:
+                    if e.code == 401 and not reauthorized:
+                        # The token was revoked or expired early; get a new one and try again.
+                        log.info("Access token rejected, getting a new one")
+                        self.tokens.invalidate()
+                        reauthorized = True
+                        continue
+                    if e.code not in RETRY_STATUS or attempt >= self.max_retries:
+                        log.error("Request failed: %s", e)
+                        raise
+                    error = e
+                    retry_after = parse_retry_after(e.headers.get("Retry-After") if e.headers else None)
+                except (OSError, http.client.HTTPException) as e:
+                    if attempt >= self.max_retries:
+                        log.error("Request failed: %s", e)
+                        raise
+                    error = e
+                    retry_after = None
+            delay = retry_delay(attempt, self.retry_backoff, self.retry_max_delay, retry_after)
+            attempt += 1
+            self.metrics.incr("retries")
+            log.warn("Request failed (%s), retry %s of %s in %.1f seconds",
+                     error, attempt, self.max_retries, delay)
+            time.sleep(delay)
 
     @staticmethod
     def deserialize(result):
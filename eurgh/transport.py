@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Contains the HTTP transport used for all API calls.
+
+Connections are kept alive and reused per host (scheme, host and port), so
+that a long run doesn't pay for a new TCP and TLS handshake on every request.
+"""
+
+from collections import defaultdict
+from logging import getLogger
+import gzip
+import http.client
+import io
+import threading
+
+# noinspection PyUnresolvedReferences
+from six.moves.urllib.error import HTTPError
+# noinspection PyUnresolvedReferences
+from six.moves.urllib.parse import urlsplit
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+# Default max number of idle connections kept per host.
+DEFAULT_POOL_SIZE = 4
+
+DEFAULT_TIMEOUT = 120
+
+# Errors meaning a kept-alive connection was closed by the server.
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError,
+                 ConnectionResetError, ConnectionAbortedError)
+
+
+class Response(object):
+    """
+    A completely read HTTP response.
+    """
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def text(self, encoding="utf-8"):
+        return self.body.decode(encoding)
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of persistent HTTP(S) connections.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, compress=False, timeout=DEFAULT_TIMEOUT, metrics=None):
+        self.pool_size = pool_size
+        self.compress = compress
+        self.timeout = timeout
+        # Optional eurgh.metrics.Metrics counting requests and bytes on the wire.
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        # (scheme, netloc) -> list of idle connections
+        self._idle = defaultdict(list)
+
+    @classmethod
+    def from_config(cls, config, metrics=None):
+        return cls(
+            pool_size=config.getint("translate", "pool_size", fallback=DEFAULT_POOL_SIZE),
+            compress=config.getboolean("translate", "compress", fallback=False),
+            timeout=config.getint("translate", "timeout", fallback=DEFAULT_TIMEOUT),
+            metrics=metrics,
+        )
+
+    def _get_connection(self, scheme, netloc):
+        """
+        :return: (connection, reused) tuple.
+        """
+        with self._lock:
+            idle = self._idle[(scheme, netloc)]
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        log.debug("Opened new connection to %s://%s", scheme, netloc)
+        return conn, False
+
+    def _put_connection(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle[(scheme, netloc)]
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, data=None, headers=None):
+        """
+        Make a request, reusing an idle connection to the host if there is one.
+
+        :raises HTTPError: if the response status is 400 or above.
+        :return: a Response
+        """
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(headers or {})
+        if self.compress:
+            headers["Accept-Encoding"] = "gzip"
+            if data:
+                data = gzip.compress(data)
+                headers["Content-Encoding"] = "gzip"
+
+        while True:
+            conn, reused = self._get_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                raw_response = conn.getresponse()
+                body = raw_response.read()
+            except _STALE_ERRORS:
+                conn.close()
+                if reused:
+                    log.debug("Reused connection to %s was closed, retrying", parts.netloc)
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            break
+
+        if raw_response.will_close:
+            conn.close()
+        else:
+            self._put_connection(parts.scheme, parts.netloc, conn)
+
+        if self.metrics is not None:
+            self.metrics.incr("http_requests")
+            self.metrics.incr("bytes_sent", len(data or b""))
+            self.metrics.incr("bytes_received", len(body))
+        if raw_response.getheader("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        if raw_response.status >= 400:
+            raise HTTPError(url, raw_response.status, raw_response.reason, raw_response.msg, io.BytesIO(body))
+        return Response(url, raw_response.status, raw_response.msg, body)
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+        return
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vim: fileencoding=utf-8 tabstop=4 expandtab shiftwidth=4
+
+"""
+Streaming encoder and decoder for the TranslateArray XML messages.
+
+The request is written straight into one bytes buffer, escaping all the
+strings in a single pass, and the response is read with iterparse, looking
+only for the precomputed namespaced TranslatedText tag and discarding each
+response element as soon as it has been read.
+"""
+
+from io import BytesIO
+from logging import getLogger
+from xml.etree.ElementTree import iterparse
+
+__author__ = 'Preston Landers (planders@gmail.com)'
+__copyright__ = 'Copyright (c) 2014 Preston Landers'
+__license__ = 'Proprietary'
+
+log = getLogger(__name__)
+
+ARRAYS_NS = "http://schemas.microsoft.com/2003/10/Serialization/Arrays"
+SERVICE_NS = "http://schemas.datacontract.org/2004/07/Microsoft.MT.Web.Service.V2"
+
+_RESPONSE_TAG = "{%s}TranslateArrayResponse" % (SERVICE_NS,)
+_TRANSLATED_TAG = "{%s}TranslatedText" % (SERVICE_NS,)
+
+_REQUEST_HEAD = """\
+<TranslateArrayRequest>
+  <AppId />
+  <From>%(from_lang)s</From>
+  <Options>
+    <Category xmlns="{ns}" >%(category)s</Category>
+    <ContentType xmlns="{ns}">%(content_type)s</ContentType>
+    <ReservedFlags xmlns="{ns}" />
+    <State xmlns="{ns}" />
+    <Uri xmlns="{ns}" />
+    <User xmlns="{ns}" />
+  </Options>
+  <Texts>
+""".replace("{ns}", SERVICE_NS)
+
+_REQUEST_TAIL = """
+  </Texts>
+  <To>%(to_lang)s</To>
+</TranslateArrayRequest>"""
+
+_STRING_OPEN = '<string xmlns="%s">' % (ARRAYS_NS,)
+_STRING_CLOSE = '</string>'
+# Never valid in XML, so it can't clash with the text.
+_SEPARATOR = "\x00"
+
+
+def escape(text):
+    """
+    >>> escape("a < b & c")
+    'a &lt; b &amp; c'
+    """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def encode_array_request(str_array, from_lang, to_lang, category="general", content_type="text/plain"):
+    """
+    :return: the TranslateArray request body for the strings, as UTF-8 bytes.
+
+    >>> body = encode_array_request(["Fish & chips", "<b>"], "en", "fr")
+    >>> decode_request_strings(body)
+    ['Fish & chips', '<b>']
+    """
+    joined = _SEPARATOR.join(str_array)
+    if joined.count(_SEPARATOR) != len(str_array) - 1:
+        raise ValueError("Strings to translate must not contain NUL characters")
+
+    buf = BytesIO()
+    buf.write((_REQUEST_HEAD % {
+        "from_lang": escape(from_lang),
+        "category": escape(category),
+        "content_type": escape(content_type),
+    }).encode("utf-8"))
+    if str_array:
+        buf.write(_STRING_OPEN.encode("utf-8"))
+        buf.write(escape(joined).replace(_SEPARATOR, _STRING_CLOSE + "\n" + _STRING_OPEN).encode("utf-8"))
+        buf.write(_STRING_CLOSE.encode("utf-8"))
+    buf.write((_REQUEST_TAIL % {"to_lang": escape(to_lang)}).encode("utf-8"))
+    return buf.getvalue()
+
+
+def decode_request_strings(body):
+    """
+    :return: the list of strings in a TranslateArray request body.
+    """
+    string_tag = "{%s}string" % (ARRAYS_NS,)
+    return [elem.text or "" for _event, elem in iterparse(BytesIO(body)) if elem.tag == string_tag]
+
+
+def decode_array_response(body):
+    """
+    Read the translations out of a TranslateArray response body.
+
+    :param body: the response, as bytes or str.
+    :return: list of translated strings, in the same order as the request.
+
+    >>> decode_array_response(
+    ...     '<ArrayOfTranslateArrayResponse xmlns="%s"><TranslateArrayResponse>'
+    ...     '<From>en</From><TranslatedText>Bonjour</TranslatedText>'
+    ...     '</TranslateArrayResponse><TranslateArrayResponse>'
+    ...     '<TranslatedText/></TranslateArrayResponse>'
+    ...     '</ArrayOfTranslateArrayResponse>' % (SERVICE_NS,))
+    ['Bonjour', '']
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    rv = []
+    text = None
+    for _event, elem in iterparse(BytesIO(body)):
+        tag = elem.tag
+        if tag == _TRANSLATED_TAG:
+            text = elem.text or ""
+        elif tag == _RESPONSE_TAG:
+            if text is None:
+                raise ValueError("TranslateArray response entry %s has no TranslatedText" % (len(rv),))
+            rv.append(text)
+            text = None
+            elem.clear()
+    return rv